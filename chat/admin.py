@@ -1,3 +1,29 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import AIUsageDaily, AIUsageHourly, AITokenUsage, Message, RoomVisit
+
+
+@admin.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'room', 'author', 'timestamp')
+    list_filter = ('room',)
+    # __str__ reads author.username; join it instead of one query per row
+    list_select_related = ('author',)
+
+
+@admin.register(RoomVisit)
+class RoomVisitAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'room', 'user', 'last_visited')
+    list_select_related = ('user',)
+
+
+@admin.register(AITokenUsage)
+class AITokenUsageAdmin(admin.ModelAdmin):
+    list_display = ('room', 'total_tokens', 'cost_usd', 'timestamp')
+    list_filter = ('room',)
+
+
+@admin.register(AIUsageHourly, AIUsageDaily)
+class AIUsageRollupAdmin(admin.ModelAdmin):
+    list_display = ('room', 'bucket', 'request_count', 'total_tokens', 'cost_usd')
+    list_filter = ('room',)
@@ -0,0 +1,223 @@
+"""
+AI reply generation for a room.
+
+``run_ai_job`` is the whole pipeline behind an ``ai_request``: budget check,
+context building, the Gemini call, persistence and the broadcast to the room
+group. It only needs the room and the requesting username, so it runs the same
+inline in ChatConsumer or in a dedicated AI worker (see ``chat.workers``).
+"""
+import os
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+from .utils import prepare_conversation_context
+
+AI_BUDGET_USD = 10.0
+
+# Messages sent to the model as context (matches prepare_conversation_context)
+CONTEXT_MESSAGES = 30
+
+# Lower runs first when the AI worker has a backlog
+PRIORITY_AUTHENTICATED = 0
+PRIORITY_ANONYMOUS = 10
+
+SYSTEM_INSTRUCTION = """
+            You are a helpful AI assistant for group planning and travel.
+
+            Rules:
+            - Keep responses SHORT (2-4 sentences) unless asked for detailed plan
+            - When asked "help plan X", provide structured steps
+            - Use **bold** and bullet points for readability
+            - Be specific with recommendations when requested
+            - Don't summarize conversation history back to users
+            """
+
+
+def room_group_name(room):
+    return f'chat_{room}'
+
+
+async def send_system_message(room, text):
+    await get_channel_layer().group_send(
+        room_group_name(room),
+        {
+            'type': 'chat_message',
+            'message': text,
+            'username': 'System',
+            'system': True,
+        }
+    )
+
+
+async def get_room_messages_values(room, limit=CONTEXT_MESSAGES):
+    from .models import Message
+    from .routers import aread_alias
+    # Only the tail feeds the model, so don't pull the whole room history
+    # Right after a write in the room the tail must include it, so read_alias pins to the primary
+    alias = await aread_alias(room=room)
+    messages = Message.objects.using(alias).filter(room=room).order_by('-timestamp')[:limit]
+    recent = [m async for m in messages.values('author__username', 'content', 'timestamp')]
+    recent.reverse()
+    return recent
+
+
+async def save_ai_message(room, content):
+    from django.contrib.auth.models import User
+    from .fragments import abump_history
+    from .models import Message
+    from .routers import apin_to_primary
+    ai_user, created = await User.objects.aget_or_create(
+        username='AI',
+        defaults={'first_name': 'AI', 'last_name': 'Assistant', 'is_active': False}
+    )
+    message = await Message.objects.acreate(
+        room=room,
+        author=ai_user,
+        content=content,
+    )
+    await abump_history(room)
+    await apin_to_primary(room=room)
+    return message
+
+
+# Stays on a thread: the usage row and its rollups are written in one transaction,
+# and transaction.atomic() has no async counterpart
+@sync_to_async
+def save_token_usage(room, prompt_tokens, response_tokens, total_tokens, cost_usd):
+    from .usage import record_token_usage
+    return record_token_usage(
+        room=room,
+        prompt_tokens=prompt_tokens,
+        response_tokens=response_tokens,
+        total_tokens=total_tokens,
+        cost_usd=cost_usd
+    )
+
+
+async def get_total_cost():
+    from .usage import aget_total_cost
+    return await aget_total_cost()
+
+
+async def generate_ai_response(room, messages_data):
+    from google import genai
+    from google.genai import types
+
+    try:
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            return "Sorry, GEMINI_API_KEY is not configured."
+
+        client = genai.Client(api_key=api_key)
+
+        # Prepare conversation with role-based context
+        conversation = prepare_conversation_context(messages_data)
+
+        # Build messages for Gemini
+        gemini_messages = []
+
+        # Add conversation history with proper roles
+        for msg in conversation:
+            gemini_messages.append(
+                types.Content(
+                    role=msg['role'],
+                    parts=[types.Part(text=msg['content'])]
+                )
+            )
+
+        # Async client so model latency doesn't block the event loop
+        response = await client.aio.models.generate_content(
+            model="gemini-2.0-flash-lite",
+            contents=gemini_messages,
+            config=types.GenerateContentConfig(
+                system_instruction=SYSTEM_INSTRUCTION,
+                temperature=0.7,
+                max_output_tokens=200  # Keep responses concise
+            )
+        )
+
+        # Token Usage Tracking
+        usage = response.usage_metadata
+        if usage:
+            prompt_tokens = usage.prompt_token_count
+            response_tokens = usage.candidates_token_count
+            total_tokens = usage.total_token_count
+
+            input_cost = (prompt_tokens / 1_000_000) * 0.075
+            output_cost = (response_tokens / 1_000_000) * 0.30
+            total_cost = input_cost + output_cost
+
+            await save_token_usage(
+                room,
+                prompt_tokens=prompt_tokens,
+                response_tokens=response_tokens,
+                total_tokens=total_tokens,
+                cost_usd=Decimal(str(total_cost))
+            )
+
+        return response.text
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+async def run_ai_job(room, requesting_username):
+    total_cost = await get_total_cost()
+    if total_cost >= AI_BUDGET_USD:
+        await send_system_message(
+            room, "AI usage limit reached ($10). Please try again later."
+        )
+        return
+
+    messages_list = await get_room_messages_values(room)
+
+    # Check if there's any conversation
+    conversation = prepare_conversation_context(messages_list)
+    if not conversation:
+        await send_system_message(
+            room, "There are no messages yet in this room. Start the conversation, then ask AI."
+        )
+        return
+
+    # Check if last message was from AI and same user is asking again
+    last_msg = messages_list[-1] if messages_list else None
+
+    if last_msg and last_msg["author__username"] == "AI":
+        # Find the last human message before the AI reply
+        last_human_msg = None
+        for msg in reversed(messages_list):
+            if msg["author__username"] not in ["AI", "System"]:
+                last_human_msg = msg
+                break
+
+        # If the same user who prompted AI is asking again immediately
+        if last_human_msg and last_human_msg["author__username"] == requesting_username:
+            await send_system_message(
+                room,
+                f"AI just responded to you, {requesting_username}. "
+                "Read the answer, add more details, or let others reply before asking again."
+            )
+            return
+
+    # Generate AI response
+    ai_response = await generate_ai_response(room, messages_list)
+
+    # If generate_ai_response returns a generic error string, send it as system message
+    if ai_response.startswith("Error:") or ai_response.startswith("Sorry"):
+        await send_system_message(
+            room, "There was a problem generating an AI response. Please try again."
+        )
+        return
+
+    await save_ai_message(room, ai_response)
+
+    await get_channel_layer().group_send(
+        room_group_name(room),
+        {
+            "type": "chat_message",
+            "message": ai_response,
+            "username": "AI",
+            "system": False,
+        }
+    )
@@ -0,0 +1,398 @@
+"""Micro-benchmarks run through ``manage.py benchmark <suite>``.
+
+Each suite is a plain function returning a dict of metrics so the command can
+print them uniformly. Suites that touch the database write into a throwaway
+``bench-*`` room and clean up after themselves.
+"""
+import asyncio
+import gc
+import os
+import statistics
+import time
+import uuid
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    return {
+        'p50_ms': round(pick(0.50) * 1000, 3),
+        'p95_ms': round(pick(0.95) * 1000, 3),
+        'p99_ms': round(pick(0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+def _bench_room():
+    return f'bench-{uuid.uuid4().hex[:8]}'
+
+
+def _bench_user():
+    from django.contrib.auth.models import User
+    user, _ = User.objects.get_or_create(username='bench', defaults={'is_active': False})
+    return user
+
+
+def _cleanup_room(room):
+    from .models import Message
+    Message.objects.filter(room=room).delete()
+
+
+async def _drive(handler, iterations, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await handler(i)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(iterations)))
+    return latencies, time.perf_counter() - started
+
+
+def bench_db(iterations=500, concurrency=20, **_):
+    """Concurrent message saves through sync_to_async, as ASGI requests issue them.
+
+    Each save runs in its own ThreadSensitiveContext and is wrapped in
+    close_old_connections(), like Django's ASGIHandler does for a request, so
+    the connection setup count reflects what ASGI traffic actually sees: one
+    connection per request unless the pool hands them out again.
+    Under the pool Django signals connection_created on every checkout, so
+    setups are then taken from the pool's own counter and the signal count is
+    reported as ``connection_checkouts``.
+    """
+    from .models import Message
+
+    user = _bench_user()
+    room = _bench_room()
+    setups = []
+
+    def on_connect(sender, connection, **kwargs):
+        setups.append(connection.alias)
+
+    def save(i):
+        close_old_connections()
+        try:
+            Message.objects.create(room=room, author_id=user.pk, content=f'bench message {i}')
+        finally:
+            close_old_connections()
+
+    async def timed_save(i):
+        async with ThreadSensitiveContext():
+            await sync_to_async(save)(i)
+
+    opened_before = _pool_connections_opened()
+
+    connection_created.connect(on_connect)
+    try:
+        latencies, elapsed = asyncio.run(_drive(timed_save, iterations, concurrency))
+    finally:
+        connection_created.disconnect(on_connect)
+        _cleanup_room(room)
+
+    pool = getattr(connections['default'], 'pool', None)
+    settings_dict = connections['default'].settings_dict
+    results = {
+        'engine': settings_dict['ENGINE'].rsplit('.', 1)[-1],
+        'conn_max_age': settings_dict['CONN_MAX_AGE'],
+        'pooled': 'pool' in settings_dict.get('OPTIONS', {}),
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'connection_setups': _pool_connections_opened() - opened_before if pool is not None else len(setups),
+        'connection_checkouts': len(setups),
+        'throughput_per_s': round(iterations / elapsed, 1),
+        **_percentiles(latencies),
+    }
+    if pool is not None:
+        results['pool_size'] = pool.get_stats().get('pool_size', 0)
+    return results
+
+
+def _pool_connections_opened():
+    # Cumulative count since the pool was created; 0 before its first use
+    pool = getattr(connections['default'], 'pool', None)
+    return pool.get_stats().get('connections_num', 0) if pool is not None else 0
+
+
+def _legacy_save_message(room, username, content):
+    # The pre-async ChatConsumer.save_message body, run through @sync_to_async
+    from django.contrib.auth.models import User
+    from .models import Message
+    try:
+        user = User.objects.get(username=username)
+    except User.DoesNotExist:
+        return None
+    return Message.objects.create(room=room, author=user, content=content)
+
+
+def _legacy_room_messages(room):
+    # Same tail query as chat.ai.get_room_messages_values, through sync_to_async,
+    # so the history metrics compare the call path rather than the amount of work
+    from .ai import CONTEXT_MESSAGES
+    from .models import Message
+    messages = Message.objects.filter(room=room).order_by('-timestamp')[:CONTEXT_MESSAGES]
+    recent = list(messages.values('author__username', 'content', 'timestamp'))
+    recent.reverse()
+    return recent
+
+
+def bench_consumer(iterations=500, concurrency=20, **_):
+    """ChatConsumer message persistence: legacy sync_to_async vs async ORM.
+
+    Both variants save ``iterations`` messages from ``concurrency`` concurrent
+    senders and then load the last CONTEXT_MESSAGES of history the way an AI
+    request does.
+    """
+    from .ai import get_room_messages_values
+    from .consumers import ChatConsumer
+
+    user = _bench_user()
+    legacy_save = sync_to_async(_legacy_save_message)
+    legacy_history = sync_to_async(_legacy_room_messages)
+    results = {'iterations': iterations, 'concurrency': concurrency}
+
+    for variant in ('legacy', 'async'):
+        room = _bench_room()
+        consumer = ChatConsumer()
+        consumer.scope = {'user_id': user.pk, 'display_name': user.username}
+        consumer.room_name = room
+
+        if variant == 'legacy':
+            async def save(i):
+                await legacy_save(room, user.username, f'bench message {i}')
+
+            async def history():
+                return await legacy_history(room)
+        else:
+            async def save(i):
+                await consumer.save_message(room, user.username, f'bench message {i}')
+
+            async def history():
+                return await get_room_messages_values(room)
+
+        async def run():
+            latencies, elapsed = await _drive(save, iterations, concurrency)
+            started = time.perf_counter()
+            await history()
+            return latencies, elapsed, time.perf_counter() - started
+
+        try:
+            latencies, elapsed, history_elapsed = asyncio.run(run())
+        finally:
+            _cleanup_room(room)
+
+        results[f'{variant}_throughput_per_s'] = round(iterations / elapsed, 1)
+        results.update({f'{variant}_{key}': value for key, value in _percentiles(latencies).items()})
+        results[f'{variant}_history_ms'] = round(history_elapsed * 1000, 3)
+
+    return results
+
+
+def bench_wire(iterations=500, **_):
+    """Bytes on the wire and encode/decode cost of each WebSocket codec.
+
+    The sample mix is a join notice, a typical chat line and a long markdown
+    AI reply (which the compact codecs compress).
+    """
+    from .wire import CODECS, DEFAULT_CODEC
+
+    ai_reply = '**Day 1**\n' + '\n'.join(
+        f'- Stop {i}: grab coffee near the station, then walk to the museum district' for i in range(40)
+    )
+    events = [
+        {'type': 'chat_message', 'message': '👋 alice joined the chat!', 'username': 'System', 'system': True},
+        {'type': 'chat_message', 'message': 'Should we book the 9am train or the 11am one?', 'username': 'alice', 'system': False},
+        {'type': 'chat_message', 'message': ai_reply, 'username': 'AI', 'system': False},
+    ]
+
+    results = {'iterations': iterations}
+    for codec in (DEFAULT_CODEC, *CODECS.values()):
+        name = codec.subprotocol or 'json'
+        frames = [codec.encode(event) for event in events]
+        results[f'{name}_bytes_per_cycle'] = sum(
+            len(frame['bytes_data']) if 'bytes_data' in frame else len(frame['text_data'].encode('utf-8'))
+            for frame in frames
+        )
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for event in events:
+                codec.encode(event)
+        results[f'{name}_encode_us'] = round((time.perf_counter() - started) / (iterations * len(events)) * 1e6, 2)
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for frame in frames:
+                codec.load_event(**frame)
+        results[f'{name}_decode_us'] = round((time.perf_counter() - started) / (iterations * len(events)) * 1e6, 2)
+    return results
+
+
+def _sample_messages(count):
+    from datetime import datetime, timedelta, timezone
+
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    authors = ('alice', 'bob', 'AI', 'carol', 'System')
+    return [
+        {
+            'author__username': authors[i % len(authors)],
+            'content': f'message number {i} about the trip itinerary',
+            'timestamp': started + timedelta(seconds=i),
+        }
+        for i in range(count)
+    ]
+
+
+def bench_context(iterations=500, **_):
+    """prepare_conversation_context() on a typical and an oversized history."""
+    from .utils import prepare_conversation_context
+
+    results = {'iterations': iterations}
+    for size in (30, 5000):
+        messages = _sample_messages(size)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            prepare_conversation_context(messages)
+        results[f'{size}_messages_us'] = round((time.perf_counter() - started) / iterations * 1e6, 2)
+    return results
+
+
+def bench_fanout(iterations=500, concurrency=20, **_):
+    """Broadcasting one chat_message to ``concurrency`` members of a room.
+
+    Reports the group_send cost on the in-memory channel layer and the
+    per-recipient JSON encoding each consumer then does in chat_message().
+    """
+    from channels.layers import InMemoryChannelLayer
+    from .wire import DEFAULT_CODEC
+
+    event = {'type': 'chat_message', 'message': 'Should we book the 9am train?', 'username': 'alice', 'system': False}
+    layer = InMemoryChannelLayer(capacity=iterations + 1)
+
+    async def run():
+        channels = [await layer.new_channel() for _ in range(concurrency)]
+        for channel in channels:
+            await layer.group_add('bench', channel)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await layer.group_send('bench', event)
+        send_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for channel in channels:
+            for _ in range(iterations):
+                DEFAULT_CODEC.encode(await layer.receive(channel))
+        return send_elapsed, time.perf_counter() - started
+
+    send_elapsed, encode_elapsed = asyncio.run(run())
+    deliveries = iterations * concurrency
+    return {
+        'iterations': iterations,
+        'recipients': concurrency,
+        'group_send_us': round(send_elapsed / iterations * 1e6, 2),
+        'receive_encode_us_per_recipient': round(encode_elapsed / deliveries * 1e6, 2),
+    }
+
+
+def _rss_bytes():
+    # Current (not peak) resident set size; Linux only
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _bench_session(user):
+    from importlib import import_module
+    from django.conf import settings
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session
+
+
+def bench_density(iterations=500, concurrency=20, **_):
+    """Memory held by ``iterations`` idle, authenticated chat WebSockets.
+
+    Connections go through the real ASGI application (auth middleware, URL
+    router, ChatConsumer) on the configured channel layer, ``concurrency`` to a
+    room. RSS per connection includes the test communicator's own queues, so
+    it overstates what a server holds a little; compare runs, not absolutes.
+    """
+    from channels.testing import WebsocketCommunicator
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from config.asgi import application
+    from .models import RoomVisit
+
+    user, _ = User.objects.get_or_create(username='bench-density')
+    session = _bench_session(user)
+    headers = [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={session.session_key}'.encode())]
+    prefix = _bench_room()
+    communicators = []
+
+    async def open_one(i):
+        communicator = WebsocketCommunicator(application, f'/ws/chat/{prefix}-{i // concurrency}/', headers=headers)
+        connected, _ = await communicator.connect()
+        assert connected, 'WebSocket handshake was rejected'
+        communicators.append(communicator)
+
+    async def close_one(i):
+        await communicators[i].disconnect()
+
+    def settle():
+        # Drop the queued join broadcasts; an idle client would have read them
+        for communicator in communicators:
+            while not communicator.output_queue.empty():
+                communicator.output_queue.get_nowait()
+        gc.collect()
+
+    async def run():
+        # Warm up imports, connections and caches before the baseline
+        await open_one(0)
+        await close_one(0)
+        communicators.clear()
+        settle()
+        before = _rss_bytes()
+        latencies, elapsed = await _drive(open_one, iterations, concurrency)
+        await asyncio.sleep(0.5)
+        settle()
+        after = _rss_bytes()
+        await _drive(close_one, len(communicators), concurrency)
+        return latencies, elapsed, before, after
+
+    try:
+        latencies, elapsed, before, after = asyncio.run(run())
+    finally:
+        RoomVisit.objects.filter(user=user, room__startswith=prefix).delete()
+        session.delete()
+
+    return {
+        'connections': iterations,
+        'rss_before_mb': round(before / 2**20, 1),
+        'rss_after_mb': round(after / 2**20, 1),
+        'rss_per_connection_kb': round((after - before) / iterations / 1024, 2),
+        'connects_per_s': round(iterations / elapsed, 1),
+        **{f'connect_{key}': value for key, value in _percentiles(latencies).items()},
+    }
+
+
+SUITES = {
+    'db': bench_db,
+    'consumer': bench_consumer,
+    'wire': bench_wire,
+    'context': bench_context,
+    'fanout': bench_fanout,
+    'density': bench_density,
+}
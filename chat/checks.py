@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def check_replica_cache(app_configs, **kwargs):
+    # Replica pins live in the cache; a per-process cache loses them between workers
+    if settings.REPLICA_DATABASE_ALIAS and settings.CACHES['default']['BACKEND'].endswith('LocMemCache'):
+        return [Warning(
+            'DATABASE_REPLICA_URL is set but the cache is local to each process.',
+            hint='Set CACHE_URL (or REDIS_URL) to a shared cache when running more than one process, '
+                 'or reads right after a write can come from a lagging replica.',
+            id='chat.W001',
+        )]
+    return []
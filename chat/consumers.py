@@ -1,44 +1,52 @@
-import json
-import os
 from channels.generic.websocket import AsyncWebsocketConsumer
-from asgiref.sync import sync_to_async
-from decimal import Decimal
 from django.utils import timezone
+from .wire import negotiate
 
 class ChatConsumer(AsyncWebsocketConsumer):
-    @sync_to_async
-    def track_room_visit(self, username):
-        from django.contrib.auth.models import User
+    # Idle sockets add up: per-connection state is the compact scope from
+    # CompactAuthMiddleware (user_id, display_name), the room and the codec
+    @property
+    def room_group_name(self):
+        return f'chat_{self.room_name}'
+
+    async def dispatch(self, message):
+        # channels hops to a thread for close_old_connections() before every
+        # handler; broadcasts never touch the database, so skip it for them
+        if message['type'] == 'chat_message':
+            await self.chat_message(message)
+            return
+        await super().dispatch(message)
+
+    async def track_room_visit(self, user_id):
+        from .fragments import abump_sidebar
         from .models import RoomVisit
-        try:
-            user = User.objects.get(username=username)
-            room_visit, created = RoomVisit.objects.update_or_create(
-                user=user,
-                room=self.room_name,
-                defaults={'last_visited': timezone.now()}
-            )
-        except User.DoesNotExist:
-            pass
+        from .routers import apin_to_primary
+        # The scope already carries the authenticated user id, no need to look it up again
+        await RoomVisit.objects.aupdate_or_create(
+            user_id=user_id,
+            room=self.room_name,
+            defaults={'last_visited': timezone.now()}
+        )
+        await abump_sidebar(user_id)
+        await apin_to_primary(user_id=user_id)
 
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'chat_{self.room_name}'
+
+        # Wire format is chosen once per connection from the offered subprotocols
+        self.codec = negotiate(self.scope.get('subprotocols', []))
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept(subprotocol=self.codec.subprotocol)
 
-        user = self.scope.get('user')
-        if user and user.is_authenticated:
-            display_name = user.username
-            await self.track_room_visit(user.username)
-        else:
-            display_name = "Anonymous"
+        if self.scope['user_id'] is not None:
+            await self.track_room_visit(self.scope['user_id'])
 
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': f'👋 {display_name} joined the chat!',
+                'message': f'👋 {self.scope["display_name"]} joined the chat!',
                 'username': 'System',
                 'system': True,
             }
@@ -46,53 +54,40 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
-        user = self.scope.get('user')
-        if user and user.is_authenticated:
-            display_name = user.username
-        else:
-            display_name = "Anonymous"
 
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': f'👋 {display_name} left the chat',
+                'message': f'👋 {self.scope["display_name"]} left the chat',
                 'username': 'System',
                 'system': True,
             }
         )
 
-    @sync_to_async
-    def save_message(self, room, username, content):
+    async def save_message(self, room, username, content):
         from django.contrib.auth.models import User
+        from .fragments import abump_history
         from .models import Message
-        try:
-            user = User.objects.get(username=username)
-        except User.DoesNotExist:
-            return None
-            
-        return Message.objects.create(
+        from .routers import apin_to_primary
+        if self.scope['user_id'] is not None and self.scope['display_name'] == username:
+            author_id = self.scope['user_id']
+        else:
+            author_id = await User.objects.filter(username=username).values_list('pk', flat=True).afirst()
+            if author_id is None:
+                return None
+
+        message = await Message.objects.acreate(
             room=room,
-            author=user,
+            author_id=author_id,
             content=content,
         )
+        await abump_history(room)
+        await apin_to_primary(user_id=author_id, room=room)
+        return message
     
-    @sync_to_async
-    def save_ai_message(self, room, content):
-        from django.contrib.auth.models import User
-        from .models import Message
-        ai_user, created = User.objects.get_or_create(
-            username='AI',
-            defaults={'first_name': 'AI', 'last_name': 'Assistant', 'is_active': False}
-        )
-        return Message.objects.create(
-            room=room,
-            author=ai_user,
-            content=content,
-        )
-
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.codec.decode(text_data, bytes_data)
         
         if data.get('type') == 'ai_request':
             await self.handle_ai_request()
@@ -114,206 +109,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def handle_ai_request(self):
-        total_cost = await self.get_total_cost()
-        if total_cost >= 10.0:
-            await self.send_system_message(
-                "AI usage limit reached ($10). Please try again later."
-            )
-            return
-        
-        messages_list = await self.get_room_messages_values()
-        
-        # Check if there's any conversation
-        conversation = await sync_to_async(self.prepare_conversation_context)(messages_list)
-        if not conversation:
-            await self.send_system_message(
-                "There are no messages yet in this room. Start the conversation, then ask AI."
-            )
-            return
-        
-        # Check if last message was from AI and same user is asking again
-        last_msg = messages_list[-1] if messages_list else None
-        current_user = self.scope.get('user')
-        requesting_username = (
-            current_user.username if current_user and current_user.is_authenticated
-            else "Anonymous"
-        )
-
-        if last_msg and last_msg["author__username"] == "AI":
-            # Find the last human message before the AI reply
-            last_human_msg = None
-            for msg in reversed(messages_list):
-                if msg["author__username"] not in ["AI", "System"]:
-                    last_human_msg = msg
-                    break
-
-            # If the same user who prompted AI is asking again immediately
-            if last_human_msg and last_human_msg["author__username"] == requesting_username:
-                await self.send_system_message(
-                    f"AI just responded to you, {requesting_username}. "
-                    "Read the answer, add more details, or let others reply before asking again."
-                )
-                return
-
-        # Generate AI response
-        ai_response = await self.generate_ai_response(messages_list)
-
-        # If generate_ai_response returns a generic error string, send it as system message
-        if ai_response.startswith("Error:") or ai_response.startswith("Sorry"):
-            await self.send_system_message(
-                "There was a problem generating an AI response. Please try again."
-            )
+        from django.conf import settings
+        from .ai import PRIORITY_ANONYMOUS, PRIORITY_AUTHENTICATED, run_ai_job
+        from .workers import worker_channel
+        authenticated = self.scope['user_id'] is not None
+        requesting_username = self.scope['display_name']
+
+        if not settings.AI_OFFLOAD:
+            await run_ai_job(self.room_name, requesting_username)
             return
 
-        await self.save_ai_message(self.room_name, ai_response)
-
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                "type": "chat_message",
-                "message": ai_response,
-                "username": "AI",
-                "system": False,
-            }
-        )
-
-
-    @sync_to_async
-    def get_room_messages_values(self):
-        from .models import Message
-        messages = Message.objects.filter(room=self.room_name).order_by('timestamp')
-        return list(messages.values('author__username', 'content', 'timestamp'))
-    
-    @sync_to_async
-    def save_token_usage(self, prompt_tokens, response_tokens, total_tokens, cost_usd):
-        from .models import AITokenUsage
-        return AITokenUsage.objects.create(
-            room=self.room_name,
-            prompt_tokens=prompt_tokens,
-            response_tokens=response_tokens,
-            total_tokens=total_tokens,
-            cost_usd=cost_usd
-        )
-    
-    @sync_to_async
-    def get_total_cost(self):
-        from .models import AITokenUsage
-        from django.db.models import Sum
-        result = AITokenUsage.objects.aggregate(total=Sum('cost_usd'))
-        return float(result['total'] or 0)
-
-    async def send_system_message(self, text):
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        # The AI worker persists and broadcasts the reply, even if we disconnect meanwhile
+        await self.channel_layer.send(
+            worker_channel(self.room_name),
             {
-                'type': 'chat_message',
-                'message': text,
-                'username': 'System',
-                'system': True,
+                'type': 'ai.generate',
+                'room': self.room_name,
+                'username': requesting_username,
+                'priority': PRIORITY_AUTHENTICATED if authenticated else PRIORITY_ANONYMOUS,
             }
         )
 
-    async def generate_ai_response(self, messages_data):
-        from google import genai
-        from google.genai import types
-        
-        try:
-            api_key = os.environ.get("GEMINI_API_KEY")
-            if not api_key:
-                return "Sorry, GEMINI_API_KEY is not configured."
-            
-            client = genai.Client(api_key=api_key)
-            
-            # Prepare conversation with role-based context
-            conversation = await sync_to_async(self.prepare_conversation_context)(messages_data)
-            
-            # Build messages for Gemini
-            gemini_messages = []
-            
-            # System instruction (concise planning assistant)
-            system_instruction = """
-            You are a helpful AI assistant for group planning and travel.
-            
-            Rules:
-            - Keep responses SHORT (2-4 sentences) unless asked for detailed plan
-            - When asked "help plan X", provide structured steps
-            - Use **bold** and bullet points for readability
-            - Be specific with recommendations when requested
-            - Don't summarize conversation history back to users
-            """
-            
-            # Add conversation history with proper roles
-            for msg in conversation:
-                gemini_messages.append(
-                    types.Content(
-                        role=msg['role'],
-                        parts=[types.Part(text=msg['content'])]
-                    )
-                )
-            
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-lite",
-                contents=gemini_messages,
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    temperature=0.7,
-                    max_output_tokens=200  # Keep responses concise
-                )
-            )
-        
-            
-            # Token Usage Tracking
-            usage = response.usage_metadata
-            if usage:
-                prompt_tokens = usage.prompt_token_count
-                response_tokens = usage.candidates_token_count
-                total_tokens = usage.total_token_count
-                
-                input_cost = (prompt_tokens / 1_000_000) * 0.075
-                output_cost = (response_tokens / 1_000_000) * 0.30
-                total_cost = input_cost + output_cost
-                
-                await self.save_token_usage(
-                    prompt_tokens=prompt_tokens,
-                    response_tokens=response_tokens,
-                    total_tokens=total_tokens,
-                    cost_usd=Decimal(str(total_cost))
-                )
-            
-            return response.text
-        except Exception as e:
-            return f"Error: {str(e)}"
-        
-
-    def prepare_conversation_context(self, messages_data, max_messages=30):
-        """Helper to prepare context"""
-        if not messages_data:
-            return []
-        
-        sorted_messages = sorted(messages_data, key=lambda x: x['timestamp'])
-        recent_messages = sorted_messages[-max_messages:]
-        
-        conversation = []
-        for msg in recent_messages:
-            username = msg['author__username']
-            content = msg['content']
-            
-            if username == 'System':
-                continue
-            
-            if username == 'AI':
-                conversation.append({'role': 'model', 'content': content})
-            else:
-                conversation.append({'role': 'user', 'content': f"{username}: {content}"})
-        
-        return conversation
-
     async def chat_message(self, event):
         try:
-            await self.send(text_data=json.dumps({
-                'message': event['message'],
-                'username': event.get('username', 'System'),
-                'system': event.get('system', False),
-            }))
+            await self.send(**self.codec.encode(event))
         except Exception:
             pass
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+Streaming room transcript export.
+
+Messages and AI usage rows are read with server-side chunked iteration,
+merged by timestamp and encoded line by line, so memory stays flat no matter
+how large the room is. The same writer backs both the HTTP endpoint (async
+iteration, since ASGI would otherwise buffer a sync iterator) and the
+``export_room`` management command (sync iteration).
+"""
+import csv
+import heapq
+import io
+import json
+import zlib
+
+from .models import AITokenUsage, Message
+
+FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+FIELDS = [
+    'type', 'timestamp', 'author', 'content',
+    'prompt_tokens', 'response_tokens', 'total_tokens', 'cost_usd',
+]
+
+CHUNK_SIZE = 2000
+# Flush the encoded buffer once it grows past this many bytes
+FLUSH_BYTES = 64 * 1024
+
+
+def _message_queryset(room, using=None):
+    return (
+        Message.objects.using(using).filter(room=room)
+        .order_by('timestamp', 'pk')
+        .values('timestamp', 'author__username', 'content')
+    )
+
+
+def _usage_queryset(room, using=None):
+    return (
+        AITokenUsage.objects.using(using).filter(room=room)
+        .order_by('timestamp', 'pk')
+        .values('timestamp', 'prompt_tokens', 'response_tokens', 'total_tokens', 'cost_usd')
+    )
+
+
+def _message_record(row):
+    return {
+        'type': 'message',
+        'timestamp': row['timestamp'],
+        'author': row['author__username'],
+        'content': row['content'],
+    }
+
+
+def _usage_record(row):
+    return {'type': 'ai_usage', **row}
+
+
+def _by_timestamp(record):
+    return record['timestamp']
+
+
+def iter_room_records(room, chunk_size=CHUNK_SIZE):
+    """Yield the room's messages and AI usage in timestamp order."""
+    messages = map(_message_record, _message_queryset(room).iterator(chunk_size=chunk_size))
+    usage = map(_usage_record, _usage_queryset(room).iterator(chunk_size=chunk_size))
+    return heapq.merge(messages, usage, key=_by_timestamp)
+
+
+async def aiter_room_records(room, chunk_size=CHUNK_SIZE, using=None):
+    """Async counterpart of iter_room_records(), optionally read from ``using``."""
+    messages = _message_queryset(room, using).aiterator(chunk_size=chunk_size)
+    usage = _usage_queryset(room, using).aiterator(chunk_size=chunk_size)
+    next_message = await anext(messages, None)
+    next_usage = await anext(usage, None)
+    while next_message is not None or next_usage is not None:
+        message_first = next_usage is None or (
+            next_message is not None and next_message['timestamp'] <= next_usage['timestamp']
+        )
+        if message_first:
+            yield _message_record(next_message)
+            next_message = await anext(messages, None)
+        else:
+            yield _usage_record(next_usage)
+            next_usage = await anext(usage, None)
+
+
+class TranscriptWriter:
+    """Encode records as JSONL or CSV, optionally gzip-compressing on the fly.
+
+    ``write()`` returns bytes once enough output has accumulated (otherwise
+    ``b''``) and ``close()`` returns whatever is left.
+    """
+
+    def __init__(self, fmt='jsonl', compress=False):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown export format: {fmt}')
+        self.fmt = fmt
+        # wbits=31 produces a gzip container rather than a raw zlib stream
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.buffer = io.StringIO()
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(self.buffer, fieldnames=FIELDS)
+            self.csv.writeheader()
+
+    def write(self, record):
+        record = {**record, 'timestamp': record['timestamp'].isoformat()}
+        if 'cost_usd' in record:
+            record['cost_usd'] = str(record['cost_usd'])
+        if self.fmt == 'csv':
+            self.csv.writerow(record)
+        else:
+            self.buffer.write(json.dumps(record, ensure_ascii=False))
+            self.buffer.write('\n')
+        if self.buffer.tell() >= FLUSH_BYTES:
+            return self._drain()
+        return b''
+
+    def close(self):
+        data = self._drain()
+        if self.compressor is not None:
+            data += self.compressor.flush()
+        return data
+
+    def _drain(self):
+        data = self.buffer.getvalue().encode('utf-8')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        return data
+
+
+def stream_transcript(records, fmt='jsonl', compress=False):
+    writer = TranscriptWriter(fmt, compress)
+    for record in records:
+        chunk = writer.write(record)
+        if chunk:
+            yield chunk
+    yield writer.close()
+
+
+async def astream_transcript(records, fmt='jsonl', compress=False):
+    writer = TranscriptWriter(fmt, compress)
+    async for record in records:
+        chunk = writer.write(record)
+        if chunk:
+            yield chunk
+    yield writer.close()
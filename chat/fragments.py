@@ -0,0 +1,47 @@
+"""
+Version keys for the cached template fragments.
+
+The sidebar is cached per user and the room history per room. Fragments are
+never deleted; instead their cache key includes a version number that is
+bumped whenever the underlying rows change, so stale entries just age out.
+Versions are seeded from the clock so an evicted version key can't resurrect
+an old fragment.
+"""
+import time
+
+from django.core.cache import cache
+
+FRAGMENT_TIMEOUT = 60 * 10
+
+SIDEBAR_VERSION_KEY = 'chat:sidebar-version:{user_id}'
+HISTORY_VERSION_KEY = 'chat:history-version:{room}'
+
+
+def sidebar_version(user_id):
+    return cache.get_or_set(SIDEBAR_VERSION_KEY.format(user_id=user_id), time.time_ns, timeout=None)
+
+
+def history_version(room):
+    return cache.get_or_set(HISTORY_VERSION_KEY.format(room=room), time.time_ns, timeout=None)
+
+
+def bump_sidebar(*user_ids):
+    cache.set_many(
+        {SIDEBAR_VERSION_KEY.format(user_id=user_id): time.time_ns() for user_id in user_ids},
+        timeout=None,
+    )
+
+
+def bump_history(room):
+    cache.set(HISTORY_VERSION_KEY.format(room=room), time.time_ns(), timeout=None)
+
+
+async def abump_sidebar(*user_ids):
+    await cache.aset_many(
+        {SIDEBAR_VERSION_KEY.format(user_id=user_id): time.time_ns() for user_id in user_ids},
+        timeout=None,
+    )
+
+
+async def abump_history(room):
+    await cache.aset(HISTORY_VERSION_KEY.format(room=room), time.time_ns(), timeout=None)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from chat.usage import backfill_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly and daily AI usage rollups from raw AITokenUsage rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', help='Only rebuild rollups for this room.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        written = backfill_rollups(room=options['room'], batch_size=options['batch_size'])
+        for resolution, count in written.items():
+            self.stdout.write(self.style.SUCCESS(f'{resolution}: {count} buckets written'))
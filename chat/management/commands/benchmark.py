@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from chat.benchmarks import SUITES
+
+
+class Command(BaseCommand):
+    help = 'Run chat performance benchmarks against the configured database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', choices=sorted(SUITES), help='Suites to run (default: all).')
+        parser.add_argument('--iterations', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20)
+
+    def handle(self, *args, **options):
+        for name in options['suites'] or SUITES:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {name} =='))
+            results = SUITES[name](
+                iterations=options['iterations'],
+                concurrency=options['concurrency'],
+            )
+            width = max(len(key) for key in results)
+            for key, value in results.items():
+                self.stdout.write(f'  {key.ljust(width)}  {value}')
@@ -0,0 +1,26 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from chat.export import CHUNK_SIZE, FORMATS, iter_room_records, stream_transcript
+
+
+class Command(BaseCommand):
+    help = "Stream a room's messages and AI usage as JSONL or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('room')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='jsonl')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output on the fly.')
+        parser.add_argument('--output', '-o', help='File to write to (default: stdout).')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        records = iter_room_records(options['room'], chunk_size=options['chunk_size'])
+        chunks = stream_transcript(records, options['format'], options['gzip'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                f.writelines(chunks)
+        else:
+            sys.stdout.buffer.writelines(chunks)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,45 @@
+"""
+Compact WebSocket authentication.
+
+``AuthMiddlewareStack`` leaves the parsed cookies, the session and a lazy
+``User`` in the scope for as long as the socket stays open, and each of its
+middleware frames keeps its own copy of that scope. ``CompactAuthMiddleware``
+resolves the session once during the handshake and passes on only
+``user_id`` (``None`` when anonymous) and ``display_name``.
+"""
+from importlib import import_module
+
+from channels.auth import get_user
+from django.conf import settings
+from django.http import parse_cookie
+
+ANONYMOUS = 'Anonymous'
+
+
+def _session_key(scope):
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            return parse_cookie(value.decode('latin1')).get(settings.SESSION_COOKIE_NAME)
+    return None
+
+
+async def resolve_user(scope):
+    """Return ``(user_id, display_name)`` for the session cookie in ``scope``."""
+    session_key = _session_key(scope)
+    if not session_key:
+        return None, ANONYMOUS
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    # Same checks as AuthMiddleware, including the session auth hash
+    user = await get_user({'session': session})
+    if not user.is_authenticated:
+        return None, ANONYMOUS
+    return user.pk, user.username
+
+
+class CompactAuthMiddleware:
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        user_id, display_name = await resolve_user(scope)
+        return await self.inner(dict(scope, user_id=user_id, display_name=display_name), receive, send)
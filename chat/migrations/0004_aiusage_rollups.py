@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_roomvisit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room', models.CharField(max_length=50)),
+                ('bucket', models.DateTimeField()),
+                ('total_tokens', models.BigIntegerField(default=0)),
+                ('cost_usd', models.DecimalField(decimal_places=6, default=0, max_digits=14)),
+                ('request_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'abstract': False,
+                'unique_together': {('room', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AIUsageHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room', models.CharField(max_length=50)),
+                ('bucket', models.DateTimeField()),
+                ('total_tokens', models.BigIntegerField(default=0)),
+                ('cost_usd', models.DecimalField(decimal_places=6, default=0, max_digits=14)),
+                ('request_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'abstract': False,
+                'unique_together': {('room', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+from datetime import timezone as dt_timezone
+
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+
+
+def backfill(apps, schema_editor):
+    # The AI budget reads the daily rollup, so fill it from existing usage rows.
+    # Self-contained on purpose: later rollup models don't exist at this point.
+    using = schema_editor.connection.alias
+    AITokenUsage = apps.get_model('chat', 'AITokenUsage')
+    for model_name, trunc in (('AIUsageHourly', TruncHour), ('AIUsageDaily', TruncDay)):
+        model = apps.get_model('chat', model_name)
+        model.objects.using(using).all().delete()
+        rows = (
+            AITokenUsage.objects.using(using)
+            .order_by()
+            .annotate(bucket_at=trunc('timestamp', tzinfo=dt_timezone.utc))
+            .values('room', 'bucket_at')
+            .annotate(
+                tokens=Sum('total_tokens'),
+                cost=Sum('cost_usd'),
+                requests=Count('id'),
+            )
+        )
+        model.objects.using(using).bulk_create(
+            (
+                model(
+                    room=row['room'],
+                    bucket=row['bucket_at'],
+                    total_tokens=row['tokens'] or 0,
+                    cost_usd=row['cost'] or 0,
+                    request_count=row['requests'],
+                )
+                for row in rows.iterator(chunk_size=1000)
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_aiusage_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
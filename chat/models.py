@@ -32,7 +32,34 @@ class AITokenUsage(models.Model):
 
     def __str__(self):
         return f"{self.room} - {self.total_tokens} tokens (${self.cost_usd})"
-    
+
+
+class AIUsageRollup(models.Model):
+    """Per-room AI usage pre-aggregated into fixed time buckets."""
+    room = models.CharField(max_length=50)
+    bucket = models.DateTimeField()
+    total_tokens = models.BigIntegerField(default=0)
+    cost_usd = models.DecimalField(max_digits=14, decimal_places=6, default=0)
+    request_count = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ['bucket']
+        unique_together = ['room', 'bucket']
+
+    def __str__(self):
+        return f"{self.room} @ {self.bucket:%Y-%m-%d %H:%M} - {self.request_count} requests (${self.cost_usd})"
+
+
+class AIUsageHourly(AIUsageRollup):
+    class Meta(AIUsageRollup.Meta):
+        pass
+
+
+class AIUsageDaily(AIUsageRollup):
+    class Meta(AIUsageRollup.Meta):
+        pass
+
 
 
 class RoomVisit(models.Model):
@@ -0,0 +1,94 @@
+"""
+Read-replica routing for history, stats and sidebar reads.
+
+Only reads made inside ``replica_reads()`` go to the replica; everything else,
+and every write, stays on the primary. Writers call ``pin_to_primary()`` so
+that for ``REPLICA_PIN_SECONDS`` afterwards the same user (or anyone reading
+the same room) keeps reading from the primary and sees their own writes
+despite replication lag.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+USER_PIN_KEY = 'chat:primary-pin:user:{user_id}'
+ROOM_PIN_KEY = 'chat:primary-pin:room:{room}'
+
+# Context-local so it follows a request or consumer task across sync_to_async hops
+_read_alias = ContextVar('chat_read_alias', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replica and primary hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != settings.REPLICA_DATABASE_ALIAS
+
+
+def _pin_keys(user_id=None, room=None):
+    keys = []
+    if user_id is not None:
+        keys.append(USER_PIN_KEY.format(user_id=user_id))
+    if room is not None:
+        keys.append(ROOM_PIN_KEY.format(room=room))
+    return keys
+
+
+def pin_to_primary(user_id=None, room=None):
+    keys = _pin_keys(user_id, room)
+    if settings.REPLICA_DATABASE_ALIAS and keys:
+        cache.set_many(dict.fromkeys(keys, True), settings.REPLICA_PIN_SECONDS)
+
+
+async def apin_to_primary(user_id=None, room=None):
+    keys = _pin_keys(user_id, room)
+    if settings.REPLICA_DATABASE_ALIAS and keys:
+        await cache.aset_many(dict.fromkeys(keys, True), settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id=None, room=None):
+    keys = _pin_keys(user_id, room)
+    return bool(keys) and bool(cache.get_many(keys))
+
+
+async def ais_pinned(user_id=None, room=None):
+    keys = _pin_keys(user_id, room)
+    return bool(keys) and bool(await cache.aget_many(keys))
+
+
+def read_alias(user_id=None, room=None):
+    """The alias history/stats reads should use right now."""
+    alias = settings.REPLICA_DATABASE_ALIAS
+    if not alias or is_pinned(user_id, room):
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+async def aread_alias(user_id=None, room=None):
+    alias = settings.REPLICA_DATABASE_ALIAS
+    if not alias or await ais_pinned(user_id, room):
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+@contextmanager
+def replica_reads(user_id=None, room=None):
+    """Route reads in the block (including lazy querysets rendered by templates)
+    through read_alias(). Yields the alias used."""
+    alias = read_alias(user_id, room)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
@@ -1,6 +1,10 @@
 from django.urls import re_path
-from . import consumers
+from . import consumers, workers
 
 websocket_urlpatterns = [
     re_path(r'^ws/chat/(?P<room_name>[\w-]+)/$', consumers.ChatConsumer.as_asgi()),
 ]
+
+channel_routes = {
+    channel: workers.AIWorkerConsumer.as_asgi() for channel in workers.worker_channels()
+}
@@ -1,3 +1,755 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import HttpCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from config.staticfiles import DEFAULT_CACHE_CONTROL, IMMUTABLE_CACHE_CONTROL, StaticFilesApp
+
+from .ai import PRIORITY_ANONYMOUS, PRIORITY_AUTHENTICATED, run_ai_job
+from .checks import check_replica_cache
+from .consumers import ChatConsumer
+from .middleware import CompactAuthMiddleware
+from .models import AITokenUsage, AIUsageDaily, AIUsageHourly, Message, RoomVisit
+from .routers import ReplicaRouter, is_pinned, read_alias, replica_reads
+from .usage import RESOLUTIONS, backfill_rollups, get_total_cost, record_token_usage
+from .utils import prepare_conversation_context
+from .workers import AIJobQueue, AIWorkerConsumer, worker_channel, worker_channels
+from .wire import (
+    CODECS, COMPRESS_THRESHOLD, COMPRESSED, DEFAULT_CODEC, SYSTEM, CompactJSONCodec, MsgPackCodec, negotiate,
+)
+
+LARGE_ROOM = 'LARGE1'
+LARGE_ROOM_MESSAGES = 2000
+LARGE_ROOM_USAGE_ROWS = 300
+
+# Plain storage: the manifest only exists after collectstatic
+PLAIN_STATIC = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+class QueryBudgetMixin:
+    """Seeds a large room and offers exact-query-count and wall-clock assertions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        cls.other = User.objects.create_user('bob', password='pw')
+        started = timezone.now() - timedelta(days=3)
+        authors = (cls.user, cls.other)
+        Message.objects.bulk_create([
+            Message(room=LARGE_ROOM, author=authors[i % 2], content=f'message {i}')
+            for i in range(LARGE_ROOM_MESSAGES)
+        ])
+        usage = AITokenUsage.objects.bulk_create([
+            AITokenUsage(
+                room=LARGE_ROOM, prompt_tokens=100, response_tokens=50,
+                total_tokens=150, cost_usd=Decimal('0.000030'),
+            )
+            for _ in range(LARGE_ROOM_USAGE_ROWS)
+        ])
+        # auto_now_add ignores explicit values on create; spread usage over three days
+        for i, row in enumerate(usage):
+            row.timestamp = started + timedelta(minutes=15 * i)
+        AITokenUsage.objects.bulk_update(usage, ['timestamp'])
+        backfill_rollups()
+        for i in range(20):
+            RoomVisit.objects.create(user=cls.user, room=f'ROOM{i}')
+            RoomVisit.objects.create(user=cls.other, room=f'ROOM{i}')
+
+    def setUp(self):
+        cache.clear()
+
+    @contextmanager
+    def assertFasterThan(self, seconds):
+        started = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, seconds, f'took {elapsed:.3f}s, budget {seconds}s')
+
+
+# Budgets are for a single database; ReplicaReadTests covers the split
+@override_settings(STORAGES=PLAIN_STATIC, REPLICA_DATABASE_ALIAS=None)
+class ViewQueryTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_index(self):
+        # session, user, recent rooms
+        with self.assertNumQueries(3), self.assertFasterThan(0.5):
+            response = self.client.get(reverse('chat:index'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_cached_sidebar(self):
+        self.client.get(reverse('chat:index'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('chat:index'))
+
+    def test_room(self):
+        # session, user, recent rooms, history (author joined, not one query per message)
+        with self.assertNumQueries(4), self.assertFasterThan(0.5):
+            response = self.client.get(reverse('chat:room', args=[LARGE_ROOM]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'message 0')
+
+    def test_room_cached_fragments(self):
+        self.client.get(reverse('chat:room', args=[LARGE_ROOM]))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('chat:room', args=[LARGE_ROOM]))
+
+    def test_room_partial(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('chat:room', args=[LARGE_ROOM]), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'hx-swap-oob')
+        self.assertNotContains(response, '<!DOCTYPE html>')
+
+    def test_room_history_invalidated_by_new_message(self):
+        self.client.get(reverse('chat:room', args=[LARGE_ROOM]))
+        consumer = ConsumerHarness(self.user, LARGE_ROOM)
+        async_to_sync(consumer.save_message)(LARGE_ROOM, 'alice', 'fresh')
+        with self.assertNumQueries(3):
+            self.client.get(reverse('chat:room', args=[LARGE_ROOM]))
+
+    def test_room_stats(self):
+        # session, user, hourly buckets; independent of the number of usage rows
+        with self.assertNumQueries(3), self.assertFasterThan(2.0):
+            response = self.client.get(reverse('chat:room_stats', args=[LARGE_ROOM]))
+        data = response.json()
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(data['request_count'], LARGE_ROOM_USAGE_ROWS)
+        self.assertLessEqual(data['buckets'], 76)
+
+    def test_room_stats_daily_range(self):
+        start = (timezone.now() - timedelta(days=2)).date().isoformat()
+        response = self.client.get(
+            reverse('chat:room_stats', args=[LARGE_ROOM]), {'resolution': 'day', 'start': start}
+        )
+        self.assertLessEqual(response.json()['buckets'], 3)
+
+    def test_delete_room(self):
+        # session, user, visitor ids, then one DELETE per table
+        with self.assertNumQueries(8), self.assertFasterThan(1.0):
+            response = self.client.post(reverse('chat:delete_room', args=[LARGE_ROOM]))
+        self.assertRedirects(response, reverse('chat:index'), fetch_redirect_response=False)
+        self.assertFalse(Message.objects.filter(room=LARGE_ROOM).exists())
+
+    def test_admin_message_changelist(self):
+        admin = User.objects.create_superuser('admin', password='pw')
+        self.client.force_login(admin)
+        # Message.__str__ reads author.username; list_select_related keeps it to one query
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('admin:chat_message_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ConsumerHarness(ChatConsumer):
+    """A ChatConsumer wired to the in-memory channel layer, recording what it sends."""
+
+    def __init__(self, user, room):
+        super().__init__()
+        self.scope = {
+            'type': 'websocket',
+            'user_id': user.pk,
+            'display_name': user.username,
+            'url_route': {'kwargs': {'room_name': room}},
+            'subprotocols': [],
+        }
+        self.channel_layer = get_channel_layer()
+        self.channel_name = 'test-consumer'
+        self.sent = []
+        self.room_name = room
+        self.codec = DEFAULT_CODEC
+
+    async def base_send(self, message):
+        self.sent.append(message)
+
+
+@override_settings(REPLICA_DATABASE_ALIAS=None)
+class ConsumerQueryTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.consumer = ConsumerHarness(self.user, LARGE_ROOM)
+
+    def test_connect(self):
+        # First visit through update_or_create: savepoint, select, nested savepoint + insert, releases
+        with self.assertNumQueries(6), self.assertFasterThan(0.2):
+            async_to_sync(self.consumer.connect)()
+        self.assertEqual(self.consumer.sent[0]['type'], 'websocket.accept')
+
+    def test_disconnect(self):
+        with self.assertNumQueries(0):
+            async_to_sync(self.consumer.disconnect)(1000)
+
+    def test_receive_message(self):
+        # The scope user is reused, so only the insert runs
+        with self.assertNumQueries(1), self.assertFasterThan(0.2):
+            async_to_sync(self.consumer.receive)(text_data='{"message": "hi", "username": "alice"}')
+
+    def test_receive_message_for_other_username(self):
+        with self.assertNumQueries(2):
+            async_to_sync(self.consumer.receive)(text_data='{"message": "hi", "username": "bob"}')
+
+    def test_chat_message(self):
+        with self.assertNumQueries(0):
+            async_to_sync(self.consumer.chat_message)(
+                {'type': 'chat_message', 'message': 'hi', 'username': 'alice', 'system': False}
+            )
+        self.assertEqual(self.consumer.sent[0]['type'], 'websocket.send')
+
+    @mock.patch('chat.ai.generate_ai_response', new_callable=mock.AsyncMock, return_value='**Plan**')
+    def test_ai_request(self, generate):
+        # budget, context tail, get_or_create AI user (select + savepoint/insert/release), insert
+        with self.assertNumQueries(7), self.assertFasterThan(0.5):
+            async_to_sync(self.consumer.receive)(text_data='{"type": "ai_request"}')
+        context = generate.call_args.args[1]
+        self.assertEqual(len(context), 30)
+        self.assertEqual(context[-1]['content'], f'message {LARGE_ROOM_MESSAGES - 1}')
+
+    def test_ai_request_repeat_is_rejected(self):
+        Message.objects.create(room=LARGE_ROOM, author=self.user, content='plan a trip')
+        ai_user = User.objects.create(username='AI', is_active=False)
+        Message.objects.create(room=LARGE_ROOM, author=ai_user, content='Here is a plan')
+        with mock.patch('chat.ai.generate_ai_response') as generate:
+            async_to_sync(run_ai_job)(LARGE_ROOM, 'alice')
+        generate.assert_not_called()
+
+
+@override_settings(REPLICA_DATABASE_ALIAS='replica')
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+
+    def test_reads_outside_block_use_primary(self):
+        self.assertIsNone(self.router.db_for_read(Message))
+        with replica_reads(user_id=1, room='R1') as alias:
+            self.assertEqual(alias, 'replica')
+            self.assertEqual(self.router.db_for_read(Message), 'replica')
+            self.assertEqual(self.router.db_for_write(Message), DEFAULT_DB_ALIAS)
+        self.assertIsNone(self.router.db_for_read(Message))
+
+    def test_write_pins_author_and_room(self):
+        user = User.objects.create_user('carol')
+        async_to_sync(ConsumerHarness(user, 'R1').save_message)('R1', 'carol', 'hi')
+        self.assertTrue(is_pinned(user_id=user.pk))
+        self.assertEqual(read_alias(user_id=user.pk), DEFAULT_DB_ALIAS)
+        # Someone else reading the room also needs the new message
+        self.assertEqual(read_alias(user_id=user.pk + 1, room='R1'), DEFAULT_DB_ALIAS)
+        self.assertEqual(read_alias(user_id=user.pk + 1, room='R2'), 'replica')
+
+    def test_no_migrations_on_replica(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'chat'))
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'chat'))
+
+    @override_settings(REPLICA_DATABASE_ALIAS=None)
+    def test_without_replica(self):
+        self.assertEqual(read_alias(user_id=1, room='R1'), DEFAULT_DB_ALIAS)
+
+    def test_warns_about_process_local_cache(self):
+        self.assertEqual([w.id for w in check_replica_cache(None)], ['chat.W001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_replica_cache(None), [])
+
+
+class CompactAuthMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+
+    def handshake(self, cookie=None):
+        seen = {}
+
+        async def inner(scope, receive, send):
+            seen.update(scope)
+
+        headers = [(b'cookie', cookie.encode())] if cookie else []
+        async_to_sync(CompactAuthMiddleware(inner))({'type': 'websocket', 'headers': headers}, None, None)
+        return seen
+
+    def test_authenticated_scope_is_compact(self):
+        self.client.force_login(self.user)
+        # session, user
+        with self.assertNumQueries(2):
+            scope = self.handshake(f'sessionid={self.client.session.session_key}')
+        self.assertEqual((scope['user_id'], scope['display_name']), (self.user.pk, 'alice'))
+        self.assertFalse({'user', 'session', 'cookies'} & scope.keys())
+
+    def test_anonymous(self):
+        with self.assertNumQueries(0):
+            scope = self.handshake()
+        self.assertEqual((scope['user_id'], scope['display_name']), (None, 'Anonymous'))
+        self.assertIsNone(self.handshake('sessionid=stale')['user_id'])
+
+
+# TransactionTestCase: the replica alias is a second connection, so it only sees committed rows
+@skipUnless(settings.REPLICA_DATABASE_ALIAS, 'set DATABASE_REPLICA_URL to run against two aliases')
+@override_settings(STORAGES=PLAIN_STATIC)
+class ReplicaReadTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='pw')
+        Message.objects.create(room='R1', author=self.user, content='message 0')
+        self.client.force_login(self.user)
+
+    def test_room_history_from_replica(self):
+        # session and user on the primary; sidebar and history on the replica
+        with self.assertNumQueries(2), self.assertNumQueries(2, using='replica'):
+            response = self.client.get(reverse('chat:room', args=['R1']))
+        self.assertContains(response, 'message 0')
+
+    def test_own_write_read_from_primary(self):
+        async_to_sync(ConsumerHarness(self.user, 'R1').save_message)('R1', 'alice', 'fresh')
+        with self.assertNumQueries(0, using='replica'):
+            response = self.client.get(reverse('chat:room', args=['R1']))
+        self.assertContains(response, 'fresh')
+
+
+class MicroBenchmarkTests(TestCase):
+    def test_prepare_conversation_context(self):
+        started = timezone.now()
+        messages = [
+            {'author__username': ('alice', 'AI', 'System')[i % 3], 'content': f'm{i}',
+             'timestamp': started + timedelta(seconds=i)}
+            for i in range(5000)
+        ]
+        begin = time.perf_counter()
+        for _ in range(20):
+            conversation = prepare_conversation_context(messages)
+        self.assertLess((time.perf_counter() - begin) / 20, 0.01)
+        self.assertEqual(len(conversation), 20)
+        self.assertEqual(conversation[-1], {'role': 'model', 'content': 'm4999'})
+
+    def test_json_fan_out(self):
+        event = {'type': 'chat_message', 'message': 'x' * 200, 'username': 'alice', 'system': False}
+        begin = time.perf_counter()
+        for _ in range(1000):
+            DEFAULT_CODEC.encode(event)
+        # Encoded once per recipient: 1000 recipients should stay well under a frame
+        self.assertLess(time.perf_counter() - begin, 0.05)
+
+
+class UsageRollupTests(TestCase):
+    def record(self, room, moment, tokens=150, cost='0.000030'):
+        # auto_now_add reads timezone.now(), so pin it to place the row in a bucket
+        with mock.patch('django.utils.timezone.now', return_value=moment):
+            return record_token_usage(room, 100, tokens - 100, tokens, Decimal(cost))
+
+    def rollups(self):
+        return {
+            resolution: list(model.objects.order_by('room', 'bucket').values_list(
+                'room', 'bucket', 'total_tokens', 'cost_usd', 'request_count'
+            ))
+            for resolution, (model, _) in RESOLUTIONS.items()
+        }
+
+    def test_incremental_matches_backfill(self):
+        started = timezone.now().replace(hour=22, minute=50) - timedelta(days=1)
+        for i in range(12):
+            self.record(('R1', 'R2')[i % 2], started + timedelta(minutes=20 * i), tokens=100 + i)
+        incremental = self.rollups()
+        self.assertGreater(len(incremental['hour']), len(incremental['day']))
+        self.assertEqual(len(incremental['day']), 4)
+
+        backfill_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_lost_insert_race_folds_into_existing_bucket(self):
+        moment = timezone.now()
+        self.record('R1', moment)
+        real_update = QuerySet.update
+        missed = []
+
+        def racing_update(queryset, **kwargs):
+            # The first UPDATE runs before a concurrent writer's INSERT is visible
+            if not missed:
+                missed.append(queryset.model)
+                return 0
+            return real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            self.record('R1', moment)
+        self.assertEqual(missed, [AIUsageHourly])
+        self.assertEqual(AIUsageHourly.objects.get().request_count, 2)
+        self.assertEqual(AIUsageDaily.objects.get().request_count, 2)
+        self.assertEqual(get_total_cost(), 0.00006)
+
+
+class RollupMigrationTests(TransactionTestCase):
+    migrate_from = [('chat', '0004_aiusage_rollups')]
+    migrate_to = [('chat', '0005_backfill_aiusage_rollups')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_migrate_backfills_budget(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        apps.get_model('chat', 'AITokenUsage').objects.create(
+            room='R1', prompt_tokens=1, response_tokens=1, total_tokens=2, cost_usd=Decimal('12.5'),
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        # The $10 cap must hold straight after migrate, without a manual backfill
+        self.assertEqual(get_total_cost(), 12.5)
+
+
+class StaticFilesAppTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = os.path.join(tmp.name, 'static')
+        os.makedirs(os.path.join(self.root, 'css'))
+        with open(os.path.join(tmp.name, 'secret.txt'), 'w') as f:
+            f.write('outside STATIC_ROOT')
+        self.css = b'body { color: black; }\n' * 50
+        self.write('css/app.css', self.css)
+        self.write('css/app.abc123.css', self.css)
+        self.write('css/app.css.gz', gzip.compress(self.css))
+        self.write('css/app.css.br', b'brotli bytes')
+        self.write_manifest({'css/app.css': 'css/app.abc123.css'})
+        self.inner = mock.AsyncMock()
+        self.app = StaticFilesApp(self.inner, root=self.root, prefix='/static/')
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(data)
+
+    def write_manifest(self, paths):
+        self.write('staticfiles.json', json.dumps({'paths': paths}).encode())
+
+    def get(self, path, method='GET', **headers):
+        headers = [(name.replace('_', '-').encode(), value.encode()) for name, value in headers.items()]
+        response = async_to_sync(HttpCommunicator(self.app, method, path, headers=headers).get_response)()
+        response['headers'] = dict(response['headers'])
+        return response
+
+    def test_path_traversal_is_404(self):
+        for path in ('/static/../secret.txt', '/static/css/../../secret.txt', '/static/css'):
+            self.assertEqual(self.get(path)['status'], 404, path)
+
+    def test_other_paths_pass_through(self):
+        async_to_sync(self.app)({'type': 'http', 'path': '/room/', 'method': 'GET'}, None, None)
+        self.inner.assert_awaited_once()
+
+    def test_encoding_preference(self):
+        response = self.get('/static/css/app.css', accept_encoding='gzip, br')
+        self.assertEqual(response['headers'][b'content-encoding'], b'br')
+        response = self.get('/static/css/app.css', accept_encoding='gzip;q=1.0')
+        self.assertEqual(response['headers'][b'content-encoding'], b'gzip')
+        self.assertEqual(gzip.decompress(response['body']), self.css)
+        # q=0 rules a coding out
+        response = self.get('/static/css/app.css', accept_encoding='br;q=0, gzip')
+        self.assertEqual(response['headers'][b'content-encoding'], b'gzip')
+        response = self.get('/static/css/app.css', accept_encoding='gzip;q=0, *')
+        self.assertEqual(response['headers'][b'content-encoding'], b'br')
+        response = self.get('/static/css/app.css', accept_encoding='*;q=0, identity')
+        self.assertNotIn(b'content-encoding', response['headers'])
+        response = self.get('/static/css/app.css')
+        self.assertNotIn(b'content-encoding', response['headers'])
+        self.assertEqual(response['body'], self.css)
+        self.assertEqual(response['headers'][b'vary'], b'Accept-Encoding')
+
+    def test_conditional_requests(self):
+        headers = self.get('/static/css/app.css')['headers']
+        response = self.get('/static/css/app.css', if_none_match=headers[b'etag'].decode())
+        self.assertEqual((response['status'], response['body']), (304, b''))
+        response = self.get('/static/css/app.css', if_modified_since=headers[b'last-modified'].decode())
+        self.assertEqual(response['status'], 304)
+        # The gzip variant has its own ETag
+        self.assertEqual(self.get('/static/css/app.css', if_none_match=headers[b'etag'].decode(),
+                                  accept_encoding='gzip')['status'], 200)
+        self.assertEqual(self.get('/static/css/app.css', if_modified_since='Thu, 01 Jan 1970 00:00:00 GMT')['status'], 200)
+
+    def test_head_and_methods(self):
+        response = self.get('/static/css/app.css', method='HEAD')
+        self.assertEqual((response['status'], response['body']), (200, b''))
+        self.assertEqual(response['headers'][b'content-length'], str(len(self.css)).encode())
+        response = self.get('/static/css/app.css', method='POST')
+        self.assertEqual(response['status'], 405)
+        self.assertEqual(response['headers'][b'allow'], b'GET, HEAD')
+
+    def test_cache_control(self):
+        self.assertEqual(self.get('/static/css/app.abc123.css')['headers'][b'cache-control'], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(self.get('/static/css/app.css')['headers'][b'cache-control'], DEFAULT_CACHE_CONTROL)
+
+    def test_collectstatic_without_restart(self):
+        self.assertEqual(self.get('/static/css/app.css')['headers'][b'cache-control'], DEFAULT_CACHE_CONTROL)
+        self.write('css/app.def456.css', self.css)
+        self.write_manifest({'css/app.css': 'css/app.def456.css'})
+        manifest = os.path.join(self.root, 'staticfiles.json')
+        os.utime(manifest, ns=(time.time_ns(), os.stat(manifest).st_mtime_ns + 10**9))
+        self.assertEqual(self.get('/static/css/app.def456.css')['headers'][b'cache-control'], IMMUTABLE_CACHE_CONTROL)
+
+
+# Export reads through read_alias(); TestCase data never reaches a replica connection
+@override_settings(REPLICA_DATABASE_ALIAS=None)
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        started = timezone.now() - timedelta(hours=1)
+        messages = [Message.objects.create(room='R1', author=cls.user, content=f'hi, "{i}"') for i in range(3)]
+        usage = [
+            AITokenUsage.objects.create(room='R1', prompt_tokens=10, response_tokens=5, total_tokens=15,
+                                        cost_usd=Decimal('0.000123'))
+            for _ in range(2)
+        ]
+        # Interleave: message, usage, message, usage, message
+        for i, row in enumerate(messages):
+            Message.objects.filter(pk=row.pk).update(timestamp=started + timedelta(minutes=2 * i))
+        for i, row in enumerate(usage):
+            AITokenUsage.objects.filter(pk=row.pk).update(timestamp=started + timedelta(minutes=2 * i + 1))
+        Message.objects.create(room='R2', author=cls.user, content='other room')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('chat:export_room', args=['R1']), params)
+
+        async def consume():
+            # The view streams from an async iterator, as it would under ASGI
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        return response, async_to_sync(consume)()
+
+    def test_jsonl_merged_in_timestamp_order(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="R1.jsonl"')
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([r['type'] for r in records], ['message', 'ai_usage'] * 2 + ['message'])
+        self.assertEqual([r['timestamp'] for r in records], sorted(r['timestamp'] for r in records))
+        self.assertEqual(records[0], {'type': 'message', 'timestamp': records[0]['timestamp'],
+                                      'author': 'alice', 'content': 'hi, "0"'})
+        self.assertEqual((records[1]['total_tokens'], records[1]['cost_usd']), (15, '0.000123'))
+
+    def test_csv(self):
+        response, body = self.export(format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual((rows[0]['author'], rows[0]['content'], rows[0]['cost_usd']), ('alice', 'hi, "0"', ''))
+        self.assertEqual(rows[1]['prompt_tokens'], '10')
+
+    def test_gzip_round_trip(self):
+        _, plain = self.export()
+        response, body = self.export(gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="R1.jsonl.gz"')
+        self.assertEqual(gzip.decompress(body), plain)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('chat:export_room', args=['R1']), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_management_command_output(self):
+        _, expected = self.export(format='csv')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'R1.csv.gz')
+            call_command('export_room', 'R1', format='csv', gzip=True, output=path, chunk_size=2)
+            with gzip.open(path) as f:
+                self.assertEqual(f.read(), expected)
+
+
+class WireFormatTests(SimpleTestCase):
+    event = {'type': 'chat_message', 'message': 'Book the 9am train?', 'username': 'alice', 'system': False}
+
+    def test_negotiate(self):
+        self.assertIs(negotiate([]), DEFAULT_CODEC)
+        self.assertIs(negotiate(['kapai.v9', 'graphql-ws']), DEFAULT_CODEC)
+        self.assertIsInstance(negotiate(['kapai.v9', 'kapai.v1.json']), CompactJSONCodec)
+        self.assertIsInstance(negotiate(['kapai.v1.msgpack', 'kapai.v1.json']), MsgPackCodec)
+
+    def test_round_trip(self):
+        long_reply = dict(self.event, message='**Plan** ' * 300, username='AI')
+        system = dict(self.event, message='👋 bob joined', username='System', system=True)
+        for codec in (DEFAULT_CODEC, *CODECS.values()):
+            for event in (self.event, long_reply, system):
+                with self.subTest(codec=type(codec).__name__, message=event['message'][:12]):
+                    self.assertEqual(
+                        codec.load_event(**codec.encode(event)),
+                        {key: event[key] for key in ('message', 'username', 'system')},
+                    )
+
+    def test_compression_threshold(self):
+        short = dict(self.event, message='x' * COMPRESS_THRESHOLD)
+        long = dict(self.event, message='x' * (COMPRESS_THRESHOLD + 1))
+        compact = CODECS['kapai.v1.json']
+        self.assertIn('text_data', compact.encode(short))
+        frame = compact.encode(long)['bytes_data']
+        self.assertEqual(json.loads(zlib.decompress(frame))['m'], long['message'])
+
+        packed = CODECS['kapai.v1.msgpack']
+        self.assertFalse(msgpack.unpackb(packed.encode(short)['bytes_data'])[2] & COMPRESSED)
+        message, _, flags = msgpack.unpackb(packed.encode(dict(long, system=True))['bytes_data'])
+        self.assertEqual(flags, COMPRESSED | SYSTEM)
+        self.assertEqual(zlib.decompress(message).decode(), long['message'])
+
+    def test_decode_client_frames(self):
+        self.assertEqual(
+            DEFAULT_CODEC.decode(text_data='{"message": "hi", "username": "alice"}'),
+            {'message': 'hi', 'username': 'alice'},
+        )
+        compact = CODECS['kapai.v1.json']
+        self.assertEqual(compact.decode(text_data='{"m":"hi","u":"alice"}'), {'message': 'hi', 'username': 'alice'})
+        self.assertEqual(compact.decode(text_data='{"t":"ai","u":"alice"}'), {'type': 'ai_request', 'username': 'alice'})
+        self.assertEqual(compact.decode(text_data='{"m":"hi"}')['username'], 'Anonymous')
+        packed = CODECS['kapai.v1.msgpack']
+        self.assertEqual(packed.decode(bytes_data=msgpack.packb({'t': 'ai', 'u': 'bob'})),
+                         {'type': 'ai_request', 'username': 'bob'})
+        # Text frames on the msgpack subprotocol are read as compact JSON
+        self.assertEqual(packed.decode(text_data='{"m":"hi","u":"bob"}'), {'message': 'hi', 'username': 'bob'})
+
+    def test_consumer_uses_negotiated_codec(self):
+        consumer = ConsumerHarness(User(pk=1, username='alice'), 'R1')
+        consumer.codec = CODECS['kapai.v1.json']
+        async_to_sync(consumer.chat_message)(self.event)
+        self.assertEqual(json.loads(consumer.sent[0]['text']), {'m': self.event['message'], 'u': 'alice'})
+
+
+class AIJobQueueTests(SimpleTestCase):
+    def drain(self, concurrency, jobs, fail=()):
+        """Submit ``jobs`` at once and return (start order, peak concurrency, peak per room)."""
+        started, running = [], []
+        peaks = {'total': 0, 'room': 0}
+
+        async def run_job(job):
+            started.append(job['id'])
+            running.append(job['room'])
+            peaks['total'] = max(peaks['total'], len(running))
+            peaks['room'] = max(peaks['room'], running.count(job['room']))
+            for _ in range(3):
+                await asyncio.sleep(0)
+            running.remove(job['room'])
+            if job['id'] in fail:
+                raise RuntimeError('model error')
+
+        async def run():
+            queue = AIJobQueue(run_job, concurrency)
+            for job in jobs:
+                queue.submit(job)
+            while queue.tasks:
+                await asyncio.gather(*list(queue.tasks))
+            self.assertEqual((queue.pending, queue.running, queue.ready), ({}, set(), []))
+
+        async_to_sync(run)()
+        return started, peaks['total'], peaks['room']
+
+    def test_fifo_within_room(self):
+        jobs = [{'id': f'A{i}', 'room': 'A'} for i in range(4)] + [{'id': 'B0', 'room': 'B'}]
+        started, _, per_room = self.drain(4, jobs)
+        self.assertEqual([job for job in started if job.startswith('A')], ['A0', 'A1', 'A2', 'A3'])
+        self.assertEqual(per_room, 1)
+
+    def test_priority_across_rooms(self):
+        jobs = [
+            {'id': 'X', 'room': 'X', 'priority': PRIORITY_ANONYMOUS},
+            {'id': 'anon', 'room': 'A', 'priority': PRIORITY_ANONYMOUS},
+            {'id': 'auth1', 'room': 'B', 'priority': PRIORITY_AUTHENTICATED},
+            {'id': 'auth2', 'room': 'C', 'priority': PRIORITY_AUTHENTICATED},
+        ]
+        started, _, _ = self.drain(1, jobs)
+        # X was already running; then authenticated rooms by arrival, then anonymous
+        self.assertEqual(started, ['X', 'auth1', 'auth2', 'anon'])
+
+    def test_concurrency_limit(self):
+        jobs = [{'id': room, 'room': room} for room in 'ABCDE']
+        started, peak, _ = self.drain(2, jobs)
+        self.assertEqual(sorted(started), list('ABCDE'))
+        self.assertEqual(peak, 2)
+
+    def test_failed_job_does_not_block_room(self):
+        jobs = [{'id': 'A0', 'room': 'A'}, {'id': 'A1', 'room': 'A'}]
+        with self.assertLogs('chat.workers', 'ERROR'):
+            started, _, _ = self.drain(1, jobs, fail={'A0'})
+        self.assertEqual(started, ['A0', 'A1'])
+
+
+@override_settings(AI_ROOM_QUEUE_LIMIT=2, AI_WORKER_CONCURRENCY=1)
+class AIWorkerConsumerTests(SimpleTestCase):
+    @mock.patch('chat.workers.send_system_message', new_callable=mock.AsyncMock)
+    @mock.patch('chat.workers.run_ai_job', new_callable=mock.AsyncMock)
+    def test_backlog_cap_per_room(self, run_ai_job, send_system_message):
+        async def run():
+            release = asyncio.Event()
+
+            async def hold(room, username):
+                await release.wait()
+
+            run_ai_job.side_effect = hold
+            worker = AIWorkerConsumer()
+            # One running, two waiting, then the room is full
+            for username in ('a', 'b', 'c', 'd'):
+                await worker.ai_generate({'type': 'ai.generate', 'room': 'R1', 'username': username})
+            # Other rooms are capped separately
+            await worker.ai_generate({'type': 'ai.generate', 'room': 'R2', 'username': 'e'})
+            for _ in range(5):
+                await asyncio.sleep(0)
+            self.assertEqual(worker.queue.queued('R1'), 2)
+            send_system_message.assert_awaited_once()
+            self.assertEqual(send_system_message.await_args.args[0], 'R1')
+            # The first job is blocked on release, so R1's later jobs have not started
+            self.assertEqual([c.args for c in run_ai_job.await_args_list], [('R1', 'a')])
+            release.set()
+            while worker.queue.tasks:
+                await asyncio.gather(*list(worker.queue.tasks))
+
+        async_to_sync(run)()
+        calls = [c.args for c in run_ai_job.await_args_list]
+        self.assertEqual([args for args in calls if args[0] == 'R1'], [('R1', 'a'), ('R1', 'b'), ('R1', 'c')])
+        self.assertIn(('R2', 'e'), calls)
+
+    @override_settings(AI_WORKER_SHARDS=4)
+    def test_rooms_stick_to_one_shard(self):
+        channels = worker_channels()
+        self.assertEqual(channels, [f'ai-generation-{shard}' for shard in range(4)])
+        shards = {worker_channel(f'ROOM{i}') for i in range(50)}
+        self.assertLessEqual(shards, set(channels))
+        self.assertGreater(len(shards), 1)
+        self.assertEqual(worker_channel('ROOM1'), worker_channel('ROOM1'))
+
+    def test_single_shard_uses_plain_channel(self):
+        self.assertEqual(worker_channels(), ['ai-generation'])
+        self.assertEqual(worker_channel('ROOM1'), 'ai-generation')
+
+
+@override_settings(AI_OFFLOAD=True, AI_WORKER_SHARDS=4)
+class AIOffloadTests(TestCase):
+    def test_request_goes_to_room_shard(self):
+        consumer = ConsumerHarness(User.objects.create_user('alice'), 'R1')
+        async_to_sync(consumer.receive)(text_data='{"type": "ai_request"}')
+        job = async_to_sync(consumer.channel_layer.receive)(worker_channel('R1'))
+        self.assertEqual(job, {'type': 'ai.generate', 'room': 'R1', 'username': 'alice',
+                               'priority': PRIORITY_AUTHENTICATED})
@@ -9,6 +9,7 @@ urlpatterns = [
     
     # API Routes
     path('api/stats/<str:room_name>/', views.get_room_stats, name='room_stats'),
+    path('api/export/<str:room_name>/', views.export_room, name='export_room'),
     
     # Room Routes
     path('<str:room_name>/', views.room, name='room'),
@@ -0,0 +1,138 @@
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import AITokenUsage, AIUsageDaily, AIUsageHourly
+
+# resolution name -> (rollup model, truncation function)
+RESOLUTIONS = {
+    'hour': (AIUsageHourly, TruncHour),
+    'day': (AIUsageDaily, TruncDay),
+}
+
+
+def bucket_start(moment, resolution):
+    """Floor a datetime to the start of its hourly or daily bucket (UTC)."""
+    moment = moment.astimezone(dt_timezone.utc) if timezone.is_aware(moment) else moment
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if resolution == 'day':
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def _bump_rollup(model, room, bucket, total_tokens, cost_usd):
+    updated = model.objects.filter(room=room, bucket=bucket).update(
+        total_tokens=F('total_tokens') + total_tokens,
+        cost_usd=F('cost_usd') + cost_usd,
+        request_count=F('request_count') + 1,
+    )
+    if updated:
+        return
+    try:
+        # Savepoint so a lost insert race doesn't poison the outer transaction
+        with transaction.atomic():
+            model.objects.create(
+                room=room,
+                bucket=bucket,
+                total_tokens=total_tokens,
+                cost_usd=cost_usd,
+                request_count=1,
+            )
+    except IntegrityError:
+        # Another writer created the bucket first; fold into theirs
+        _bump_rollup(model, room, bucket, total_tokens, cost_usd)
+
+
+def record_token_usage(room, prompt_tokens, response_tokens, total_tokens, cost_usd):
+    """Store one AI usage row and fold it into the hourly and daily rollups."""
+    with transaction.atomic():
+        usage = AITokenUsage.objects.create(
+            room=room,
+            prompt_tokens=prompt_tokens,
+            response_tokens=response_tokens,
+            total_tokens=total_tokens,
+            cost_usd=cost_usd,
+        )
+        for resolution, (model, _) in RESOLUTIONS.items():
+            _bump_rollup(
+                model,
+                room,
+                bucket_start(usage.timestamp, resolution),
+                total_tokens,
+                Decimal(cost_usd),
+            )
+    return usage
+
+
+def backfill_rollups(room=None, batch_size=1000):
+    """Rebuild rollup tables from raw AITokenUsage rows.
+
+    Existing buckets for the affected rooms are replaced, so the command is
+    safe to re-run. Returns a dict of resolution -> number of buckets written.
+    """
+    written = {}
+    with transaction.atomic():
+        for resolution, (model, trunc) in RESOLUTIONS.items():
+            usage = AITokenUsage.objects.all()
+            rollups = model.objects.all()
+            if room is not None:
+                usage = usage.filter(room=room)
+                rollups = rollups.filter(room=room)
+            rollups.delete()
+
+            rows = (
+                usage.order_by()
+                .annotate(bucket_at=trunc('timestamp', tzinfo=dt_timezone.utc))
+                .values('room', 'bucket_at')
+                .annotate(
+                    tokens=Sum('total_tokens'),
+                    cost=Sum('cost_usd'),
+                    requests=Count('id'),
+                )
+            )
+            objs = [
+                model(
+                    room=row['room'],
+                    bucket=row['bucket_at'],
+                    total_tokens=row['tokens'] or 0,
+                    cost_usd=row['cost'] or 0,
+                    request_count=row['requests'],
+                )
+                for row in rows.iterator(chunk_size=batch_size)
+            ]
+            model.objects.bulk_create(objs, batch_size=batch_size)
+            written[resolution] = len(objs)
+    return written
+
+
+def get_usage_buckets(room, resolution='hour', start=None, end=None):
+    """Return rollup rows for a room ordered by bucket, within [start, end)."""
+    model, _ = RESOLUTIONS[resolution]
+    buckets = model.objects.filter(room=room)
+    if start is not None:
+        buckets = buckets.filter(bucket__gte=bucket_start(start, resolution))
+    if end is not None:
+        buckets = buckets.filter(bucket__lt=end)
+    return buckets.order_by('bucket').values('bucket', 'total_tokens', 'cost_usd', 'request_count')
+
+
+def get_total_cost(room=None):
+    """Total AI spend from the daily rollups, optionally for a single room."""
+    totals = AIUsageDaily.objects.all()
+    if room is not None:
+        totals = totals.filter(room=room)
+    result = totals.aggregate(total=Sum('cost_usd'))
+    return float(result['total'] or 0)
+
+
+async def aget_total_cost(room=None):
+    """Async counterpart of get_total_cost()."""
+    totals = AIUsageDaily.objects.all()
+    if room is not None:
+        totals = totals.filter(room=room)
+    result = await totals.aaggregate(total=Sum('cost_usd'))
+    return float(result['total'] or 0)
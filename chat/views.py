@@ -6,17 +6,40 @@ import io
 import base64
 import random
 import string
+from datetime import datetime, time
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
-from .models import Message, RoomVisit, AITokenUsage
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .export import FORMATS, aiter_room_records, astream_transcript
+from .fragments import FRAGMENT_TIMEOUT, bump_history, bump_sidebar, history_version, sidebar_version
+from .models import Message, RoomVisit, AITokenUsage, AIUsageDaily, AIUsageHourly
+from .routers import pin_to_primary, read_alias, replica_reads
+from .usage import RESOLUTIONS, get_usage_buckets
+
+def _sidebar_context(request, room_name=None):
+    # Querysets stay lazy; they only hit the database when the cached fragment misses
+    return {
+        'room_name': room_name,
+        'username': request.user.get_username(),
+        'recent_rooms': RoomVisit.objects.filter(user=request.user)[:5],
+        'sidebar_version': sidebar_version(request.user.pk),
+        'fragment_timeout': FRAGMENT_TIMEOUT,
+    }
+
+def _is_partial(request):
+    # History restores after a cache miss need the whole page back
+    return bool(request.htmx) and not request.htmx.history_restore_request
 
 @login_required
 def index(request):
-    recent_rooms = RoomVisit.objects.filter(user=request.user)[:5]
-    return render(request, 'chat/index.html', {
-        'recent_rooms': recent_rooms
-    })
+    context = _sidebar_context(request)
+    context['partial'] = _is_partial(request)
+    template = 'chat/index_pane.html' if context['partial'] else 'chat/index.html'
+    # The sidebar querysets are lazy, so render inside the block
+    with replica_reads(request.user.pk):
+        return render(request, template, context)
 
 def create_room(request):
     # Generate random 6-character room code
@@ -25,38 +48,89 @@ def create_room(request):
 
 @login_required
 def room(request, room_name):
-    messages = Message.objects.filter(room=room_name).select_related('author')[:50]
-    recent_rooms = RoomVisit.objects.filter(user=request.user)[:5]
-    return render(request, 'chat/room.html', {
-        'room_name': room_name,
-        'username': request.user.get_username(),
-        'messages': messages,
-        'recent_rooms': recent_rooms,
+    context = _sidebar_context(request, room_name)
+    context.update({
+        'messages': Message.objects.filter(room=room_name).select_related('author')[:50],
+        'history_version': history_version(room_name),
+        'partial': _is_partial(request),
     })
+    template = 'chat/room_pane.html' if context['partial'] else 'chat/room.html'
+    with replica_reads(request.user.pk, room_name):
+        return render(request, template, context)
 
 @login_required
 def delete_room(request, room_name):
+    visitor_ids = list(RoomVisit.objects.filter(room=room_name).values_list('user_id', flat=True))
+
     # Delete all data for this room
     Message.objects.filter(room=room_name).delete()
     RoomVisit.objects.filter(room=room_name).delete()
     AITokenUsage.objects.filter(room=room_name).delete()
+    AIUsageHourly.objects.filter(room=room_name).delete()
+    AIUsageDaily.objects.filter(room=room_name).delete()
+
+    bump_history(room_name)
+    bump_sidebar(request.user.pk, *visitor_ids)
+    pin_to_primary(user_id=request.user.pk, room=room_name)
     
     return redirect('chat:index')
 
+@login_required
+def export_room(request, room_name):
+    fmt = request.GET.get('format', 'jsonl')
+    if fmt not in FORMATS:
+        return JsonResponse({'status': 'error', 'message': 'format must be "jsonl" or "csv"'}, status=400)
+    compress = request.GET.get('gzip') in ('1', 'true')
+
+    # Async iterator: under ASGI a sync one would be buffered whole before sending.
+    # It runs after the view returns, so the alias is picked now rather than routed.
+    records = aiter_room_records(room_name, using=read_alias(request.user.pk, room_name))
+    response = StreamingHttpResponse(
+        astream_transcript(records, fmt, compress),
+        content_type='application/gzip' if compress else FORMATS[fmt],
+    )
+    filename = f"{room_name}.{fmt}{'.gz' if compress else ''}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def _parse_range_bound(value):
+    """Parse an ISO date or datetime query param into an aware datetime."""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
 @login_required
 def get_room_stats(request, room_name):
-    # 1. Fetch Data (Optimized)
-    # Use .values() to get a list of dicts directly, which is faster for Pandas to load
-    usage_queryset = AITokenUsage.objects.filter(room=room_name).values('timestamp', 'cost_usd')
+    resolution = request.GET.get('resolution', 'hour')
+    if resolution not in RESOLUTIONS:
+        return JsonResponse({'status': 'error', 'message': 'resolution must be "hour" or "day"'}, status=400)
+    try:
+        start = _parse_range_bound(request.GET.get('start'))
+        end = _parse_range_bound(request.GET.get('end'))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    # 1. Fetch Data (Pre-aggregated)
+    # Rollup rows are one per bucket, so cost scales with the range, not the request count
+    with replica_reads(request.user.pk, room_name):
+        buckets = list(get_usage_buckets(room_name, resolution=resolution, start=start, end=end))
     
     # 2. Insert Pandas: Data Transformation
-    df = pd.DataFrame(list(usage_queryset))
+    df = pd.DataFrame(buckets)
 
     if df.empty:
         return JsonResponse({'status': 'no_data'})
 
     # Best Practice: Ensure types are correct for math/plotting
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df['timestamp'] = pd.to_datetime(df['bucket'])
     df['cost_usd'] = pd.to_numeric(df['cost_usd'])
     
     # Sort by time (crucial for cumulative sums)
@@ -109,5 +183,9 @@ def get_room_stats(request, room_name):
     return JsonResponse({
         'status': 'success',
         'chart': f"data:image/png;base64,{graphic}",
-        'total_spent': round(float(total_spent), 4)
+        'total_spent': round(float(total_spent), 4),
+        'total_tokens': int(df['total_tokens'].sum()),
+        'request_count': int(df['request_count'].sum()),
+        'resolution': resolution,
+        'buckets': len(df),
     })
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+WebSocket wire formats for ChatConsumer.
+
+Clients pick a format through WebSocket subprotocol negotiation; a client that
+offers none gets the original verbose JSON. Every codec turns a channel-layer
+``chat_message`` event into ``send()`` kwargs and turns an incoming frame back
+into the legacy ``{'type', 'message', 'username'}`` dict the consumer handles.
+
+* ``kapai.v1.json`` - short keys (``m``/``u``/``s``); replies longer than
+  ``COMPRESS_THRESHOLD`` go out as a binary frame holding the zlib-deflated JSON.
+* ``kapai.v1.msgpack`` - ``[message, username, flags]`` arrays in binary frames;
+  flag ``COMPRESSED`` marks a zlib-deflated message body.
+"""
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is optional
+    msgpack = None
+
+COMPRESS_THRESHOLD = 1024
+
+SYSTEM = 1
+COMPRESSED = 2
+
+
+class JSONCodec:
+    subprotocol = None
+
+    def encode(self, event):
+        return {'text_data': json.dumps({
+            'message': event['message'],
+            'username': event.get('username', 'System'),
+            'system': event.get('system', False),
+        })}
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data)
+
+    def load_event(self, text_data=None, bytes_data=None):
+        return json.loads(text_data)
+
+
+class CompactJSONCodec:
+    subprotocol = 'kapai.v1.json'
+
+    def encode(self, event):
+        payload = {'m': event['message'], 'u': event.get('username', 'System')}
+        if event.get('system'):
+            payload['s'] = 1
+        text = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+        if len(payload['m']) > COMPRESS_THRESHOLD:
+            return {'bytes_data': zlib.compress(text.encode('utf-8'))}
+        return {'text_data': text}
+
+    def decode(self, text_data=None, bytes_data=None):
+        data = json.loads(text_data if text_data is not None else bytes_data)
+        return _expand(data)
+
+    def load_event(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            text_data = zlib.decompress(bytes_data)
+        data = json.loads(text_data)
+        return {'message': data['m'], 'username': data['u'], 'system': bool(data.get('s'))}
+
+
+class MsgPackCodec:
+    subprotocol = 'kapai.v1.msgpack'
+
+    def encode(self, event):
+        message = event['message']
+        flags = SYSTEM if event.get('system') else 0
+        if len(message) > COMPRESS_THRESHOLD:
+            message = zlib.compress(message.encode('utf-8'))
+            flags |= COMPRESSED
+        return {'bytes_data': msgpack.packb([message, event.get('username', 'System'), flags])}
+
+    def decode(self, text_data=None, bytes_data=None):
+        data = msgpack.unpackb(bytes_data) if bytes_data is not None else json.loads(text_data)
+        return _expand(data)
+
+    def load_event(self, text_data=None, bytes_data=None):
+        message, username, flags = msgpack.unpackb(bytes_data)
+        if flags & COMPRESSED:
+            message = zlib.decompress(message).decode('utf-8')
+        return {'message': message, 'username': username, 'system': bool(flags & SYSTEM)}
+
+
+def _expand(data):
+    """Map a short-key client frame ({'t', 'm', 'u'}) onto the legacy keys."""
+    expanded = {'username': data.get('u', 'Anonymous')}
+    if data.get('t') == 'ai':
+        expanded['type'] = 'ai_request'
+    else:
+        expanded['message'] = data['m']
+    return expanded
+
+
+DEFAULT_CODEC = JSONCodec()
+
+CODECS = {codec.subprotocol: codec for codec in (CompactJSONCodec(), MsgPackCodec())}
+if msgpack is None:
+    del CODECS[MsgPackCodec.subprotocol]
+
+
+def negotiate(subprotocols):
+    """Return the first codec the client offered that the server supports."""
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return DEFAULT_CODEC
@@ -0,0 +1,115 @@
+"""
+Dedicated AI worker processes.
+
+Web consumers hand ``ai_request``s to the room's worker channel and
+``manage.py runworker <channel>`` processes run them, so model latency scales
+with worker count instead of tying up the processes holding WebSockets, and a
+reply still lands in the room if the requester disconnects.
+
+Each room hashes onto one of ``AI_WORKER_SHARDS`` channels. Run exactly one
+worker process per channel: AIJobQueue only orders jobs it sees, so a room's
+jobs must all land in the same process.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import zlib
+from collections import deque
+
+from channels.consumer import AsyncConsumer
+from django.conf import settings
+
+from .ai import run_ai_job, send_system_message
+
+logger = logging.getLogger(__name__)
+
+
+def worker_channel(room):
+    """The AI worker channel that serves ``room``."""
+    shards = settings.AI_WORKER_SHARDS
+    if shards == 1:
+        return settings.AI_WORKER_CHANNEL
+    # crc32 rather than hash(): it has to agree across processes
+    return f'{settings.AI_WORKER_CHANNEL}-{zlib.crc32(room.encode()) % shards}'
+
+
+def worker_channels():
+    shards = settings.AI_WORKER_SHARDS
+    if shards == 1:
+        return [settings.AI_WORKER_CHANNEL]
+    return [f'{settings.AI_WORKER_CHANNEL}-{shard}' for shard in range(shards)]
+
+
+class AIJobQueue:
+    """Schedules AI jobs: FIFO within a room, by priority across rooms.
+
+    At most one job per room runs at a time, so replies in a room come out in
+    request order, and at most ``concurrency`` rooms run at once. Rooms compete
+    on the priority of their oldest pending job (lower runs first), ties broken
+    by arrival.
+    """
+
+    def __init__(self, run_job, concurrency):
+        self.run_job = run_job
+        self.concurrency = concurrency
+        self.pending = {}       # room -> deque of jobs waiting to run
+        self.ready = []         # heap of (priority, seq, room) for idle rooms with work
+        self.running = set()    # rooms with a job in flight
+        self.tasks = set()
+        self._seq = itertools.count()
+
+    def queued(self, room):
+        return len(self.pending.get(room, ()))
+
+    def submit(self, job):
+        room = job['room']
+        jobs = self.pending.setdefault(room, deque())
+        jobs.append(job)
+        # A room sits in the heap at most once, and never while it's running
+        if len(jobs) == 1 and room not in self.running:
+            self._push(room)
+        self._dispatch()
+
+    def _push(self, room):
+        heapq.heappush(self.ready, (self.pending[room][0].get('priority', 0), next(self._seq), room))
+
+    def _dispatch(self):
+        while self.ready and len(self.running) < self.concurrency:
+            _, _, room = heapq.heappop(self.ready)
+            job = self.pending[room].popleft()
+            self.running.add(room)
+            task = asyncio.create_task(self._run(room, job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, room, job):
+        try:
+            await self.run_job(job)
+        except Exception:
+            logger.exception('AI job failed for room %s', room)
+        finally:
+            self.running.discard(room)
+            if self.pending.get(room):
+                self._push(room)
+            else:
+                self.pending.pop(room, None)
+            self._dispatch()
+
+
+class AIWorkerConsumer(AsyncConsumer):
+    """Receives ``ai.generate`` messages on the AI worker channel."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue = AIJobQueue(self.run_job, settings.AI_WORKER_CONCURRENCY)
+
+    async def ai_generate(self, message):
+        # Only enqueue here: the handler has to return before the next message is read
+        if self.queue.queued(message['room']) >= settings.AI_ROOM_QUEUE_LIMIT:
+            await send_system_message(message['room'], "AI is busy with this room. Please try again in a moment.")
+            return
+        self.queue.submit(message)
+
+    async def run_job(self, job):
+        await run_ai_job(job['room'], job['username'])
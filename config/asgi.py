@@ -10,17 +10,28 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from chat import routing
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
+# Set up Django before importing anything that touches settings or models
+http_application = get_asgi_application()
+
+from django.conf import settings
+from chat import routing
+from chat.middleware import CompactAuthMiddleware
+from config.staticfiles import StaticFilesApp
+
+if not settings.DEBUG:
+    http_application = StaticFilesApp(http_application)
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": http_application,
+    # Only user_id and display_name reach the consumer, keeping idle sockets small
+    "websocket": CompactAuthMiddleware(
         URLRouter(
             routing.websocket_urlpatterns
         )
     ),
+    "channel": ChannelNameRouter(routing.channel_routes),
 })
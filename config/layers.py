@@ -0,0 +1,27 @@
+"""
+Channel layer used when no Redis is configured.
+
+The stock ``InMemoryChannelLayer`` sweeps every channel and group membership
+for expired messages on each ``receive()`` and ``group_send()``. Every idle
+WebSocket keeps a channel waiting in ``receive()``, so with thousands of them
+in one process each delivered message cost O(connections). This layer runs
+the same sweep at most once per ``clean_interval`` seconds.
+"""
+
+import time
+
+from channels.layers import InMemoryChannelLayer
+
+
+class SweepingInMemoryChannelLayer(InMemoryChannelLayer):
+    def __init__(self, clean_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.clean_interval = clean_interval
+        self._next_clean = 0.0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now < self._next_clean:
+            return
+        self._next_clean = now + self.clean_interval
+        super()._clean_expired()
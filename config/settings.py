@@ -15,6 +15,7 @@ import environ
 from get_ip import get_local_ip
 import dj_database_url
 import os
+from django.core.exceptions import ImproperlyConfigured
 
 
 env = environ.Env(
@@ -101,16 +102,99 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# No persistent connections by default: under ASGI every request runs in its
+# own thread-sensitive context, so a connection is never reused by the next
+# request and CONN_MAX_AGE would only leave it open. Reuse comes from the pool.
 DATABASES = {
-    'default': dj_database_url.parse(env('DATABASE_URL'))
+    'default': dj_database_url.parse(
+        env('DATABASE_URL'),
+        conn_max_age=env.int('DB_CONN_MAX_AGE', default=0),
+        conn_health_checks=True,
+    )
 }
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
-    }
+# Optional read replica for history, stats and sidebar reads (see chat.routers).
+# Locally, point DATABASE_REPLICA_URL at the same database as DATABASE_URL to
+# exercise the routing with two aliases.
+REPLICA_DATABASE_ALIAS = None
+if env('DATABASE_REPLICA_URL', default=None):
+    REPLICA_DATABASE_ALIAS = 'replica'
+    DATABASES[REPLICA_DATABASE_ALIAS] = dj_database_url.parse(
+        env('DATABASE_REPLICA_URL'),
+        conn_max_age=env.int('DB_CONN_MAX_AGE', default=0),
+        conn_health_checks=True,
+    )
+    # Tests read the replica through the primary's test database
+    DATABASES[REPLICA_DATABASE_ALIAS]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['chat.routers.ReplicaRouter']
+
+# After a write, the writer's reads stay on the primary this long
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=5)
+
+# psycopg 3 connection pool (PostgreSQL only). ASGI workers run ORM calls on
+# executor threads, so without a pool each thread opens its own connection.
+# Django's pool does not mix with persistent connections, so CONN_MAX_AGE stays 0.
+# The primary and the replica each get a pool of this size.
+postgres_databases = [
+    database for database in DATABASES.values()
+    if database['ENGINE'] == 'django.db.backends.postgresql'
+]
+if env.bool('DB_POOL', default=True) and postgres_databases:
+    from psycopg_pool import ConnectionPool
+
+    for database in postgres_databases:
+        database['CONN_MAX_AGE'] = 0
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+            'max_size': env.int('DB_POOL_MAX_SIZE', default=10),
+            'timeout': env.float('DB_POOL_TIMEOUT', default=10.0),
+            # Close connections idle longer than this, and recycle all after max_lifetime
+            'max_idle': env.float('DB_POOL_MAX_IDLE', default=300.0),
+            'max_lifetime': env.float('DB_POOL_MAX_LIFETIME', default=1800.0),
+            'check': ConnectionPool.check_connection,
+        }
+
+# Shared by the fragment cache, its version keys and replica pins, so every
+# process must see the same one. With REDIS_URL (several processes) it
+# defaults to that Redis; CACHE_URL overrides it.
+CACHES = {
+    'default': env.cache('CACHE_URL', default=env('REDIS_URL', default='locmemcache://')),
 }
 
+# AI workers run in their own processes, so offloading needs a shared (Redis) layer
+if env('REDIS_URL', default=None):
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [env('REDIS_URL')]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "config.layers.SweepingInMemoryChannelLayer"
+        }
+    }
+
+# AI generation: inline in the WebSocket consumer, or offloaded to
+# `manage.py runworker ai-generation` processes when AI_OFFLOAD is on.
+# Rooms are spread over AI_WORKER_SHARDS channels (ai-generation-0, -1, ...
+# when more than one), each served by exactly one worker process.
+AI_OFFLOAD = env.bool('AI_OFFLOAD', default=False)
+AI_WORKER_CHANNEL = 'ai-generation'
+AI_WORKER_SHARDS = env.int('AI_WORKER_SHARDS', default=1)
+AI_WORKER_CONCURRENCY = env.int('AI_WORKER_CONCURRENCY', default=4)
+AI_ROOM_QUEUE_LIMIT = env.int('AI_ROOM_QUEUE_LIMIT', default=5)
+
+if AI_OFFLOAD:
+    # Jobs sent over an in-memory layer never reach a worker process, and the
+    # worker's cache writes (history versions, replica pins) must reach the web
+    if not env('REDIS_URL', default=None):
+        raise ImproperlyConfigured('AI_OFFLOAD requires REDIS_URL so jobs reach the AI workers.')
+    if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+        raise ImproperlyConfigured('AI_OFFLOAD requires a shared cache; unset CACHE_URL or point it at Redis.')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -164,7 +248,18 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
-STATIC_ROOT = Path("/var/www/kapai.static")
+STATIC_ROOT = Path(env('STATIC_ROOT', default=str(BASE_DIR / 'staticfiles')))
+
+# collectstatic writes content-hashed names plus .gz/.br variants;
+# config.staticfiles.StaticFilesApp serves them under ASGI when DEBUG is off.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'config.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
 
 
 # Default primary key field type
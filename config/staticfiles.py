@@ -0,0 +1,204 @@
+"""
+Production static file pipeline.
+
+``CompressedManifestStaticFilesStorage`` fingerprints files at ``collectstatic``
+time and writes ``.gz`` (and ``.br`` when brotli is installed) siblings next to
+every compressible file. ``StaticFilesApp`` is an ASGI wrapper that serves
+those files straight from ``STATIC_ROOT``, picking the precompressed variant the
+client accepts and answering conditional requests with 304s.
+"""
+
+import asyncio
+import gzip
+import json
+import mimetypes
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.html', '.xml'}
+MIN_COMPRESS_SIZE = 256
+
+# Hashed names never change content, so caches may keep them forever
+IMMUTABLE_CACHE_CONTROL = b'public, max-age=31536000, immutable'
+DEFAULT_CACHE_CONTROL = b'public, max-age=60'
+
+# Preferred first; (Accept-Encoding token, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        # Compress the originals and their hashed copies once hashing has settled
+        for name in list(paths) + list(self.hashed_files.values()):
+            if self._should_compress(name):
+                self._compress(name)
+
+    def _should_compress(self, name):
+        return Path(name).suffix.lower() in COMPRESSIBLE_EXTENSIONS and self.exists(name)
+
+    def _compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            # Only keep variants that actually save bytes
+            if len(compressed) < len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+
+
+def _immutable_names(root):
+    """Hashed filenames from the manifest written by collectstatic."""
+    manifest = os.path.join(root, ManifestStaticFilesStorage.manifest_name)
+    try:
+        mtime = os.stat(manifest).st_mtime_ns
+    except OSError:
+        return frozenset()
+    # Keyed on mtime so a collectstatic run is picked up without a restart
+    return _read_manifest(manifest, mtime)
+
+
+@lru_cache(maxsize=1)
+def _read_manifest(manifest, mtime):
+    try:
+        with open(manifest, encoding='utf-8') as f:
+            return frozenset(json.load(f).get('paths', {}).values())
+    except (OSError, ValueError):
+        return frozenset()
+
+
+def _parse_accept_encoding(header):
+    """Map each coding in an Accept-Encoding header to its q-value."""
+    qvalues = {}
+    for token in header.decode('latin-1').split(','):
+        coding, *params = [part.strip() for part in token.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding.lower()] = q
+    return qvalues
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st.st_size, st.st_mtime
+
+
+class StaticFilesApp:
+    """Serve STATIC_URL from STATIC_ROOT in front of another ASGI application."""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.root = os.path.realpath(root or settings.STATIC_ROOT)
+        self.prefix = prefix or settings.STATIC_URL
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.prefix):
+            return await self.application(scope, receive, send)
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await self._respond(send, 405, [(b'allow', b'GET, HEAD')])
+
+        name = scope['path'][len(self.prefix):]
+        path = os.path.realpath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep) or _stat(path) is None:
+            return await self._respond(send, 404)
+
+        headers = dict(scope.get('headers', []))
+        immutable = name in _immutable_names(self.root)
+        served_path, encoding = self._pick_variant(path, headers.get(b'accept-encoding', b''))
+        size, mtime = _stat(served_path)
+        etag = f'"{int(mtime):x}-{size:x}{"-" + encoding if encoding else ""}"'.encode()
+
+        response_headers = [
+            (b'content-type', self._content_type(path)),
+            (b'cache-control', IMMUTABLE_CACHE_CONTROL if immutable else DEFAULT_CACHE_CONTROL),
+            (b'etag', etag),
+            (b'last-modified', formatdate(mtime, usegmt=True).encode()),
+            (b'vary', b'Accept-Encoding'),
+        ]
+        if self._not_modified(headers, etag, mtime):
+            return await self._respond(send, 304, response_headers)
+
+        if encoding:
+            response_headers.append((b'content-encoding', encoding.encode()))
+        response_headers.append((b'content-length', str(size).encode()))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+        if scope['method'] == 'HEAD':
+            return await send({'type': 'http.response.body', 'body': b''})
+
+        with open(served_path, 'rb') as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                more = len(chunk) == self.chunk_size
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more})
+                if not more:
+                    break
+
+    @staticmethod
+    def _pick_variant(path, accept_encoding):
+        qvalues = _parse_accept_encoding(accept_encoding)
+        for encoding, suffix in ENCODINGS:
+            # q=0 means "not acceptable" (RFC 9110 12.5.3); codings not listed fall back to "*"
+            if qvalues.get(encoding, qvalues.get('*', 0)) > 0 and _stat(path + suffix) is not None:
+                return path + suffix, encoding
+        return path, None
+
+    @staticmethod
+    def _content_type(path):
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        return content_type.encode()
+
+    @staticmethod
+    def _not_modified(headers, etag, mtime):
+        if b'if-none-match' in headers:
+            candidates = [tag.strip() for tag in headers[b'if-none-match'].split(b',')]
+            return etag in candidates or b'*' in candidates
+        if b'if-modified-since' in headers:
+            try:
+                since = parsedate_to_datetime(headers[b'if-modified-since'].decode('latin-1'))
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+
+    @staticmethod
+    async def _respond(send, status, headers=()):
+        await send({'type': 'http.response.start', 'status': status, 'headers': list(headers)})
+        await send({'type': 'http.response.body', 'body': b''})